@@ -1,13 +1,24 @@
 # encoding: utf-8
+import hmac
 import json
 from flask import Flask, request, jsonify
 from celery.result import AsyncResult
-from celery_tasks import app as celery_app, process_task_queue
-import mysql.connector
+from werkzeug.exceptions import RequestEntityTooLarge
+import celery_client
+from celery_client import get_celery_app
+import circuit_breaker
+import eta_estimator
+import profiler
+import task_schemas
+import tracing
+from mysql.connector import pooling
 import requests
+import uuid
 from datetime import datetime, timedelta
 import logging
 import os
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -21,42 +32,90 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 flask_app = Flask(__name__)
+# Werkzeug 对所有接口（包括没有 Content-Length 的分块请求）强制执行的请求体上限，按最大的图片上传设置；
+# /submit_task 另外限制为 MAX_SUBMIT_BODY_BYTES
+flask_app.config['MAX_CONTENT_LENGTH'] = max(int(os.getenv('MAX_UPLOAD_BYTES', 10 * 1024 * 1024)),
+                                             task_schemas.MAX_SUBMIT_BODY_BYTES)
+
+tracing.init_tracing('back_serv')
+
+# 数据库连接池和HTTP会话在第一次使用时创建；gunicorn preload 模式下 fork 之后由 reset_after_fork 清空
+# gthread worker 中多个线程可能同时第一次使用，创建过程加锁，避免重复创建的连接池泄漏连接
+_db_pool = None
+_http_session = None
+_init_lock = threading.Lock()
 
 def get_db_connection():
-    return mysql.connector.connect(
-        host=os.getenv('DB_HOST'),
-        port=int(os.getenv('DB_PORT')),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        database=os.getenv('DB_NAME')
-    )
+    global _db_pool
+    if _db_pool is None:
+        with _init_lock:
+            if _db_pool is None:
+                _db_pool = pooling.MySQLConnectionPool(
+                    pool_name=f"back_serv_{os.getpid()}",
+                    pool_size=int(os.getenv('DB_POOL_SIZE', 8)),
+                    host=os.getenv('DB_HOST'),
+                    port=int(os.getenv('DB_PORT')),
+                    user=os.getenv('DB_USER'),
+                    password=os.getenv('DB_PASSWORD'),
+                    database=os.getenv('DB_NAME')
+                )
+    # conn.close() 会把连接归还到连接池；连接池满时直接抛出 PoolError，不会等待
+    return _db_pool.get_connection()
+
+@contextmanager
+def db_connection():
+    """从连接池取出连接，无论正常返回还是出错都归还"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def get_http_session():
+    global _http_session
+    if _http_session is None:
+        with _init_lock:
+            if _http_session is None:
+                _http_session = requests.Session()
+    return _http_session
+
+def reset_after_fork():
+    """在 gunicorn worker fork 之后调用，丢弃从 master 继承的连接池和会话"""
+    global _db_pool, _http_session, _init_lock
+    _db_pool = None
+    _http_session = None
+    _init_lock = threading.Lock()
+    celery_client.reset_after_fork()
 
 def get_server_load():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    query = """
-    SELECT serv_name, 
-           SUM(CASE WHEN status IN ('Queueing', 'In Progress') THEN 1 ELSE 0 END) as active_tasks,
-           SUM(CASE WHEN status = 'In Progress' AND started_at < %s THEN 1 ELSE 0 END) as stuck_tasks
-    FROM sride_queue
-    GROUP BY serv_name
-    """
-    
-    timeout_threshold = datetime.now() - timedelta(seconds=int(os.getenv('TASK_TIMEOUT_SECONDS', 300)))
-    cursor.execute(query, (timeout_threshold,))
-    server_loads = {row['serv_name']: row for row in cursor.fetchall()}
-    
-    cursor.close()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        
+        query = """
+        SELECT serv_name, 
+               SUM(CASE WHEN status IN ('Queueing', 'In Progress') THEN 1 ELSE 0 END) as active_tasks,
+               SUM(CASE WHEN status = 'In Progress' AND started_at < %s THEN 1 ELSE 0 END) as stuck_tasks
+        FROM sride_queue
+        GROUP BY serv_name
+        """
+        
+        timeout_threshold = datetime.now() - timedelta(seconds=int(os.getenv('TASK_TIMEOUT_SECONDS', 300)))
+        cursor.execute(query, (timeout_threshold,))
+        server_loads = {row['serv_name']: row for row in cursor.fetchall()}
+        
+        cursor.close()
     
     return server_loads
 
 def get_available_server():
-    server_loads = get_server_load()
-    ai_server_status = requests.get(f"{os.getenv('AI_SERVER_URL')}{os.getenv('AI_SERVER_STATUS_ENDPOINT')}").json()
+    with tracing.span('get_server_load'):
+        server_loads = get_server_load()
+    with tracing.span('ai_server_status_request'):
+        ai_server_status = get_http_session().get(f"{os.getenv('AI_SERVER_URL')}{os.getenv('AI_SERVER_STATUS_ENDPOINT')}").json()
     
-    available_servers = [server['serv_name'] for server in ai_server_status if server['serv_status'] == 'online']
+    # 排除已被熔断的服务器
+    available_servers = [server['serv_name'] for server in ai_server_status
+                         if server['serv_status'] == 'online' and circuit_breaker.is_available(server['serv_name'])]
     
     if not available_servers:
         raise Exception("没有可用的AI服务器")
@@ -71,34 +130,72 @@ def get_available_server():
             min_load = current_load
             selected_server = server
     
+    tracing.set_attribute('serv_name', selected_server)
     return selected_server
 
+def _read_submit_body():
+    """
+    读取并解析 /submit_task 的请求体，最多读取 MAX_SUBMIT_BODY_BYTES + 1 字节，
+    分块传输（没有 Content-Length）的请求也不会被完整读入内存
+
+    :return: 解析后的JSON，请求体不是JSON时返回 None
+    :raises RequestEntityTooLarge: 请求体超过 MAX_SUBMIT_BODY_BYTES
+    """
+    limit = task_schemas.MAX_SUBMIT_BODY_BYTES
+    if request.content_length and request.content_length > limit:
+        raise RequestEntityTooLarge()
+    body = request.stream.read(limit + 1)
+    if len(body) > limit:
+        raise RequestEntityTooLarge()
+    if not request.is_json:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
 @flask_app.route('/submit_task', methods=['POST'])
 def submit_task():
+    # 在选择服务器、写库和发送任务之前校验请求
     try:
-        data = request.json
-        task_type = data['task_type']
-        task_params = data['task_params']
-        user_id = data['user_id']
-
-        # 获取可用的服务器
-        selected_server = get_available_server()
-
-        # 将任务发送到Celery，分别传递task_params和serv_name
-        task = celery_app.send_task(task_type, args=[task_params, user_id, selected_server])
-
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        insert_query = """
-        INSERT INTO sride_queue (ticket_id, user_id, serv_name, task_type, task_params, status)
-        VALUES (%s, %s, %s, %s, %s, 'Queueing')
-        """
-        cursor.execute(insert_query, (task.id, user_id, selected_server, task_type, json.dumps(task_params)))
-        conn.commit()
+        data = _read_submit_body()
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"请求体不能超过 {task_schemas.MAX_SUBMIT_BODY_BYTES} 字节"}), 413
+    if not isinstance(data, dict):
+        return jsonify({"error": "请求体必须是JSON对象"}), 400
+    for key in ('task_type', 'task_params', 'user_id'):
+        if key not in data:
+            return jsonify({"error": f"缺少{key}参数"}), 400
+    try:
+        task_type, task_params = task_schemas.validate_task(data['task_type'], data['task_params'])
+        user_id = task_schemas.validate_user_id(data['user_id'])
+    except task_schemas.TaskParamsError as e:
+        return jsonify({"error": str(e)}), 400
 
-        cursor.close()
-        conn.close()
+    try:
+        # 预先生成ticket_id，作为trace属性并随消息头传给worker
+        ticket_id = str(uuid.uuid4())
+        with tracing.span('submit_task', ticket_id=ticket_id, task_type=task_type):
+            # 获取可用的服务器
+            with tracing.span('get_available_server'):
+                selected_server = get_available_server()
+
+            # 将任务发送到Celery，分别传递task_params和serv_name
+            with tracing.span('send_task'):
+                task = get_celery_app().send_task(task_type, args=[task_params, user_id, selected_server],
+                                            task_id=ticket_id, headers=tracing.inject_headers(ticket_id))
+
+            with tracing.span('db_insert'), db_connection() as conn:
+                cursor = conn.cursor()
+
+                insert_query = """
+                INSERT INTO sride_queue (ticket_id, user_id, serv_name, task_type, task_params, status)
+                VALUES (%s, %s, %s, %s, %s, 'Queueing')
+                """
+                cursor.execute(insert_query, (task.id, user_id, selected_server, task_type, task_schemas.canonical_json(task_params)))
+                conn.commit()
+
+                cursor.close()
 
         return jsonify({"ticket_id": task.id, "serv_name": selected_server, "status": "Queueing"}), 202
     except Exception as e:
@@ -107,14 +204,22 @@ def submit_task():
 
 @flask_app.route('/query_task/<ticket_id>', methods=['GET'])
 def query_task(ticket_id):
-    task_result = AsyncResult(ticket_id, app=celery_app)
+    with tracing.span('query_task', ticket_id=ticket_id):
+        return _query_task(ticket_id)
 
-    conn = get_db_connection()
+def _query_task(ticket_id):
+    task_result = AsyncResult(ticket_id, app=get_celery_app())
+
+    with db_connection() as conn:
+        return _query_task_info(conn, ticket_id)
+
+def _query_task_info(conn, ticket_id):
     cursor = conn.cursor(dictionary=True)
 
-    select_query = "SELECT * FROM sride_queue WHERE ticket_id = %s"
-    cursor.execute(select_query, (ticket_id,))
-    task_info = cursor.fetchone()
+    with tracing.span('db_select'):
+        select_query = "SELECT * FROM sride_queue WHERE ticket_id = %s"
+        cursor.execute(select_query, (ticket_id,))
+        task_info = cursor.fetchone()
 
     if not task_info:
         return jsonify({"error": "任务不存在"}), 404
@@ -126,19 +231,30 @@ def query_task(ticket_id):
 
     if task_info['status'] == 'Queueing':
         # 获取队列中排在前面的任务数量
-        count_query = "SELECT COUNT(*) as count FROM sride_queue WHERE status = 'Queueing' AND created_at < %s"
-        cursor.execute(count_query, (task_info['created_at'],))
-        queue_position = cursor.fetchone()['count']
+        with tracing.span('queue_position'):
+            count_query = "SELECT COUNT(*) as count FROM sride_queue WHERE status = 'Queueing' AND created_at < %s"
+            cursor.execute(count_query, (task_info['created_at'],))
+            queue_position = cursor.fetchone()['count']
         response["queue_position"] = queue_position
 
+    if task_info['status'] in ('Queueing', 'In Progress'):
+        # 预计开始/完成时间和建议的轮询间隔
+        try:
+            with tracing.span('eta_estimate'):
+                response.update(eta_estimator.estimate(cursor, task_info))
+        except Exception as e:
+            logger.warning(f"估算任务完成时间失败: ticket_id={ticket_id}, 错误: {str(e)}")
+
     cursor.close()
-    conn.close()
 
     return jsonify(response)
 
 @flask_app.route('/cancel_task/<ticket_id>', methods=['POST'])
 def cancel_task(ticket_id):
-    conn = get_db_connection()
+    with db_connection() as conn:
+        return _cancel_task(conn, ticket_id)
+
+def _cancel_task(conn, ticket_id):
     cursor = conn.cursor()
 
     select_query = "SELECT status FROM sride_queue WHERE ticket_id = %s"
@@ -155,16 +271,16 @@ def cancel_task(ticket_id):
     cursor.execute(update_query, (ticket_id,))
     conn.commit()
 
-    celery_app.control.revoke(ticket_id, terminate=True)
+    get_celery_app().control.revoke(ticket_id, terminate=True)
 
     cursor.close()
-    conn.close()
 
     return jsonify({"message": "任务已取消"})
 
 @flask_app.route('/process_queue', methods=['POST'])
 def trigger_process_queue():
-    process_task_queue.delay()
+    # 按任务名发送，网关不需要导入 celery_tasks
+    get_celery_app().send_task('celery_tasks.process_task_queue')
     return jsonify({"message": "队列处理已触发"}), 202
 
 DIFY_URL = os.getenv('DIFY_URL')
@@ -185,7 +301,10 @@ def call_dify_service(prompt_text, api_key):
         "Content-Type": "application/json"
     }
 
-    response = requests.post(f"{DIFY_URL}/workflows/run", json=request_body, headers=headers)
+    with tracing.span('call_dify_service') as current_span:
+        response = get_http_session().post(f"{DIFY_URL}/workflows/run", json=request_body, headers=headers)
+        if current_span is not None:
+            current_span.set_attribute('http.status_code', response.status_code)
 
     if response.status_code == 200:
         processed_text = response.json().get('data', {}).get('outputs', {})
@@ -227,7 +346,7 @@ def face_bbox():
     if request.method == 'POST':
         try:
             image_data = request.files['image']
-            response = requests.post(
+            response = get_http_session().post(
                 f"{os.getenv('AI_SERVER_URL')}{os.getenv('FACE_BBOX_ENDPOINT')}",
                 files={'image': image_data}
             )
@@ -237,6 +356,22 @@ def face_bbox():
             return jsonify({'error': str(e)}), 500
     return jsonify({'error': 'Method not allowed'}), 405
 
+@flask_app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """采样网关进程的调用栈，返回火焰图使用的 collapsed stack 文本"""
+    # 经过反向代理时请求来源都是本机，无法按地址判断，必须配置令牌；令牌只从请求头读取，不会出现在访问日志中
+    if not profiler.PROFILER_ENABLED or not profiler.PROFILER_TOKEN:
+        return jsonify({"error": "采样分析未开启"}), 404
+    if not hmac.compare_digest(request.headers.get('X-Profiler-Token', ''), profiler.PROFILER_TOKEN):
+        return jsonify({"error": "无权访问"}), 403
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        return profiler.profile(seconds), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    except ValueError:
+        return jsonify({"error": "seconds 必须是正数"}), 400
+    except profiler.ProfilerBusyError as e:
+        return jsonify({"error": str(e)}), 409
+
 if __name__ == '__main__':
     flask_app.run(
         debug=os.getenv('FLASK_DEBUG', '0') == '1',
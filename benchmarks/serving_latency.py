@@ -0,0 +1,65 @@
+# encoding: utf-8
+"""
+网关延迟压测，用于比较开发服务器（python back_serv.py）和 gunicorn 生产模式
+
+用法:
+    python benchmarks/serving_latency.py --url http://localhost:4093 --path /query_task/<ticket_id> \
+        --concurrency 16 --requests 2000
+"""
+import argparse
+import threading
+import time
+
+import requests
+
+
+def run(url, concurrency, total_requests):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_thread = total_requests // concurrency
+
+    def worker():
+        session = requests.Session()
+        local = []
+        local_errors = 0
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            try:
+                response = session.get(url, timeout=30)
+                if response.status_code >= 500:
+                    local_errors += 1
+            except requests.RequestException:
+                local_errors += 1
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+
+    print(f"url={url} concurrency={concurrency} requests={len(latencies)} errors={errors[0]}")
+    print(f"throughput={len(latencies) / elapsed:.1f} req/s")
+    print(f"p50={percentile(0.50):.2f}ms p95={percentile(0.95):.2f}ms "
+          f"p99={percentile(0.99):.2f}ms max={latencies[-1] * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='网关延迟压测')
+    parser.add_argument('--url', default='http://localhost:4093')
+    parser.add_argument('--path', default='/query_task/benchmark')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+    run(args.url.rstrip('/') + args.path, args.concurrency, args.requests)
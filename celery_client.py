@@ -0,0 +1,59 @@
+# encoding: utf-8
+"""
+网关使用的 Celery 生产者
+
+网关只需要发送任务、撤销任务和读取结果，不需要导入 celery_tasks（任务定义、定时任务、worker 信号）。
+Celery 应用在第一次使用时才创建，在 gunicorn preload 模式下也会在 fork 之后的子进程中创建，
+不会和 master 进程共享 broker 连接。
+"""
+import os
+import threading
+
+from celery import Celery
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+BROKER_URL = f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', 6379)}/{os.getenv('REDIS_DB_BROKER', 0)}"
+RESULT_BACKEND = f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', 6379)}/{os.getenv('REDIS_DB_BACKEND', 1)}"
+
+# 定时维护任务（状态写库、耗时统计、队列检查）使用单独的队列，由单独的 worker 消费，
+# 不会排在长时间运行的 AI 任务后面：celery -A celery_tasks worker -Q maintenance
+MAINTENANCE_QUEUE = os.getenv('CELERY_MAINTENANCE_QUEUE', 'maintenance')
+TASK_ROUTES = {
+    'celery_tasks.flush_task_status_updates': {'queue': MAINTENANCE_QUEUE},
+    'celery_tasks.update_eta_statistics': {'queue': MAINTENANCE_QUEUE},
+    'celery_tasks.process_task_queue': {'queue': MAINTENANCE_QUEUE},
+    'celery_tasks.check_and_update_stuck_tasks': {'queue': MAINTENANCE_QUEUE},
+}
+
+_celery_app = None
+_init_lock = threading.Lock()
+
+
+def get_celery_app():
+    global _celery_app
+    if _celery_app is None:
+        # 多个线程可能同时第一次使用
+        with _init_lock:
+            if _celery_app is None:
+                app = Celery('tasks', broker=BROKER_URL, backend=RESULT_BACKEND)
+                app.conf.update(
+                    task_serializer='json',
+                    accept_content=['json'],
+                    result_serializer='json',
+                    timezone='UTC',
+                    enable_utc=True,
+                    task_routes=TASK_ROUTES,
+                    broker_connection_retry_on_startup=True
+                )
+                _celery_app = app
+    return _celery_app
+
+
+def reset_after_fork():
+    """丢弃 fork 之前创建的 Celery 应用，子进程第一次使用时重新创建"""
+    global _celery_app, _init_lock
+    _celery_app = None
+    _init_lock = threading.Lock()
@@ -1,12 +1,22 @@
 from celery import Celery
+from celery.exceptions import SoftTimeLimitExceeded
 import json
 import mysql.connector
 import requests
 import logging
+import time
 from datetime import datetime, timedelta
 from celery.schedules import crontab
+from celery.signals import task_prerun, task_postrun, worker_process_init, worker_process_shutdown
 import os
 from dotenv import load_dotenv
+import redis
+import circuit_breaker
+import eta_estimator
+import status_writer
+import profiler
+import tracing
+from celery_client import BROKER_URL, RESULT_BACKEND, TASK_ROUTES
 
 # 加载环境变量
 load_dotenv()
@@ -18,9 +28,40 @@ logger = logging.getLogger(__name__)
 # celery -A celery_tasks worker --loglevel=info
 
 # 创建Celery应用
-app = Celery('tasks', 
-             broker=f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', 6379)}/{os.getenv('REDIS_DB_BROKER', 0)}", 
-             backend=f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', 6379)}/{os.getenv('REDIS_DB_BACKEND', 1)}")
+app = Celery('tasks', broker=BROKER_URL, backend=RESULT_BACKEND)
+
+# 每个worker子进程 fork 之后再初始化追踪、采样分析和状态写库线程，避免后台线程跨进程共享
+_profiler = None
+_status_flusher = None
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    global _profiler, _status_flusher
+    tracing.init_tracing('celery_worker')
+    _profiler = profiler.start_background_profiler('celery_worker')
+    # 状态变更由 worker 自己写库，不依赖 beat 和 maintenance worker
+    _status_flusher = status_writer.BackgroundFlusher(get_db_connection)
+    _status_flusher.start()
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    if _profiler is not None:
+        _profiler.stop()
+    if _status_flusher is not None:
+        _status_flusher.stop()
+
+# 每个任务一个span，trace context 从网关写入的消息头中恢复
+_task_spans = {}
+
+@task_prerun.connect
+def start_task_span(task_id=None, task=None, **kwargs):
+    handle = tracing.start_task_span(task)
+    if handle is not None:
+        _task_spans[task_id] = handle
+
+@task_postrun.connect
+def end_task_span(task_id=None, state=None, **kwargs):
+    tracing.end_task_span(_task_spans.pop(task_id, None), state)
 
 # 数据库连接函数
 def get_db_connection():
@@ -34,36 +75,35 @@ def get_db_connection():
 
 # 更新任务状态的函数
 def update_task_status(ticket_id, status, result_info=None, error_info=None, serv_name=None, serv_switch_info=None):
+    """
+    记录任务状态变更
+
+    变更先写入 Redis Stream，由 flush_task_status_updates 定时批量写库；
+    Redis 不可用时直接写库。
+    """
+    try:
+        status_writer.enqueue_status(ticket_id, status, result_info=result_info, error_info=error_info,
+                                     serv_name=serv_name, serv_switch_info=serv_switch_info)
+        logger.info(f"任务状态变更已加入写入队列: ticket_id={ticket_id}, status={status}")
+        return
+    except redis.RedisError as e:
+        logger.warning(f"状态写入队列不可用，直接写库: ticket_id={ticket_id}, status={status}, error={str(e)}")
+
     try:
+        merged = status_writer.merge_updates([{
+            "ticket_id": ticket_id,
+            "status": status,
+            "result_info": result_info,
+            "error_info": error_info,
+            "serv_name": serv_name,
+            "serv_switch_info": serv_switch_info,
+            "event_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }])
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        update_query = """
-        UPDATE sride_queue 
-        SET status = %s, 
-            result_info = %s, 
-            error_info = %s, 
-            started_at = CASE WHEN %s = 'In Progress' THEN NOW() ELSE started_at END,
-            completed_at = CASE WHEN %s IN ('Completed', 'Cancelled', 'System Error') THEN NOW() ELSE completed_at END,
-            serv_name = CASE WHEN %s IS NOT NULL THEN %s ELSE serv_name END,
-            serv_switch_info = CASE WHEN %s IS NOT NULL THEN %s ELSE serv_switch_info END
-        WHERE ticket_id = %s
-        """
-        
-        cursor.execute(update_query, (status, 
-                                      result_info, 
-                                      error_info, 
-                                      status, 
-                                      status, 
-                                      serv_name, 
-                                      serv_name, 
-                                      serv_switch_info, 
-                                      serv_switch_info, 
-                                      ticket_id))
-        conn.commit()
-        
-        cursor.close()
-        conn.close()
+        try:
+            status_writer.write_updates(conn, merged)
+        finally:
+            conn.close()
         logger.info(f"成功更新任务状态: ticket_id={ticket_id}, status={status}")
     except Exception as e:
         logger.error(f"更新任务状态失败: ticket_id={ticket_id}, status={status}, error={str(e)}")
@@ -120,16 +160,29 @@ app.conf.beat_schedule = {
     },
 }
 
+class NoServerAvailable(Exception):
+    """没有在线且未被熔断的服务器，属于临时状态，可以退避后重试"""
+
+# 服务器状态查询也会在软超时之后的重试流程中执行，超时时间需要很短
+AI_STATUS_TIMEOUT_SECONDS = float(os.getenv('AI_STATUS_TIMEOUT_SECONDS', 5))
+
+def _fetch_server_status():
+    return requests.get(f"{os.getenv('AI_SERVER_URL')}{os.getenv('AI_SERVER_STATUS_ENDPOINT')}",
+                        timeout=AI_STATUS_TIMEOUT_SECONDS).json()
+
 def get_server_status(serv_name):
-    ai_server_status = requests.get(f"{os.getenv('AI_SERVER_URL')}{os.getenv('AI_SERVER_STATUS_ENDPOINT')}").json()
+    ai_server_status = _fetch_server_status()
     for server in ai_server_status:
         if server['serv_name'] == serv_name:
             return server['serv_status']
     return 'unknown'
 
 def get_available_server(exclude=[]):
-    ai_server_status = requests.get(f"{os.getenv('AI_SERVER_URL')}{os.getenv('AI_SERVER_STATUS_ENDPOINT')}").json()
-    available_servers = [server['serv_name'] for server in ai_server_status if server['serv_status'] == 'online' and server['serv_name'] not in exclude]
+    ai_server_status = _fetch_server_status()
+    available_servers = [server['serv_name'] for server in ai_server_status
+                         if server['serv_status'] == 'online'
+                         and server['serv_name'] not in exclude
+                         and circuit_breaker.is_available(server['serv_name'])]
     
     return available_servers[0] if available_servers else None
 
@@ -152,59 +205,182 @@ def is_server_busy(serv_name):
 # 使用环境变量
 AI_SERVER_URL = os.getenv('AI_SERVER_URL')
 
-def check_and_switch_server(ticket_id, original_serv_name):
+# 超时设置：AI 请求超时 < 软超时 < 硬超时。
+# requests 的 timeout 只限制单次读等待，软超时保证整个任务在被强制终止之前还有时间记录失败并重试；
+# 硬超时直接杀掉 worker 进程，熔断器和重试都不会执行。
+TASK_TIMEOUT_SECONDS = int(os.getenv('TASK_TIMEOUT_SECONDS', 300))
+TASK_SOFT_TIMEOUT_SECONDS = int(os.getenv('TASK_SOFT_TIMEOUT_SECONDS', TASK_TIMEOUT_SECONDS - 15))
+AI_REQUEST_TIMEOUT_SECONDS = float(os.getenv('AI_REQUEST_TIMEOUT_SECONDS', TASK_TIMEOUT_SECONDS - 60))
+
+def call_ai_server(serv_name, endpoint, task_params):
+    """
+    调用AI服务器接口，并把调用结果反馈给熔断器：读超时、任务软超时、5xx 和慢请求计为失败，
+    连接错误属于共用入口的故障，不计入该服务器
+
+    :param serv_name: 执行任务的服务器名称
+    :param endpoint: AI服务器接口路径，例如 '/image_creation'
+    :param task_params: 请求参数
+    :return: requests.Response
+    """
+    start_time = time.time()
+    try:
+        with tracing.span('call_ai_server', serv_name=serv_name, endpoint=endpoint) as current_span:
+            response = requests.post(f"{AI_SERVER_URL}{endpoint}", json=task_params,
+                                     timeout=AI_REQUEST_TIMEOUT_SECONDS)
+            if current_span is not None:
+                current_span.set_attribute('http.status_code', response.status_code)
+    except requests.ConnectionError:
+        # 所有服务器共用 AI_SERVER_URL，连不上（包括连接超时）说明共用入口不可用，不计入 serv_name 的熔断器，
+        # 否则入口故障会让所有服务器同时熔断
+        raise
+    except (requests.Timeout, SoftTimeLimitExceeded) as e:
+        circuit_breaker.record_failure(serv_name, reason=type(e).__name__)
+        raise
+
+    if response.status_code >= 500:
+        circuit_breaker.record_failure(serv_name, reason=f"HTTP {response.status_code}")
+    else:
+        circuit_breaker.record_success(serv_name, latency=time.time() - start_time)
+    response.raise_for_status()
+    return response
+
+# 失败重试配置，可以按任务类型单独设置重试次数
+MAX_RETRIES = int(os.getenv('MAX_RETRIES', 3))
+TASK_MAX_RETRIES = {
+    'Image Creation': int(os.getenv('MAX_RETRIES_IMAGE_CREATION', MAX_RETRIES)),
+    'Image Upscale': int(os.getenv('MAX_RETRIES_IMAGE_UPSCALE', MAX_RETRIES)),
+    'Face Swap': int(os.getenv('MAX_RETRIES_FACE_SWAP', MAX_RETRIES)),
+}
+RETRY_BACKOFF_SECONDS = int(os.getenv('RETRY_BACKOFF_SECONDS', 5))
+RETRY_BACKOFF_MAX_SECONDS = int(os.getenv('RETRY_BACKOFF_MAX_SECONDS', 60))
+
+def is_retryable_error(exc):
+    """
+    判断错误是否值得换一台服务器重试
+
+    超时（包括任务软超时）、连接错误、5xx、429 和暂时没有可用服务器（例如刚被熔断）属于临时故障，可以重试；
+    其余 4xx 和参数、解析错误属于请求本身的问题，重试也不会成功。
+    """
+    if isinstance(exc, (requests.Timeout, requests.ConnectionError, SoftTimeLimitExceeded, NoServerAvailable)):
+        return True
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return False
+
+def retry_or_fail(task, serv_name, task_params, user_id, exc, error_info, tried_servers=None, switch_history=None):
+    """
+    任务失败时，在重试次数内把任务重新分配到其他服务器，否则标记为 System Error
+
+    :param task: 绑定的Celery任务（bind=True 时的 self）
+    :param serv_name: 本次执行失败的服务器名称
+    :param task_params: 任务参数
+    :param user_id: 用户ID
+    :param exc: 捕获到的异常
+    :param error_info: 写入 error_info 的错误信息
+    :param tried_servers: 之前已经失败过的服务器列表
+    :param switch_history: 之前的切换和重试记录，写入 serv_switch_info 时在其后追加
+    :return: 不再重试时返回 {"error": error_info}；重试时抛出 celery.exceptions.Retry
+    """
+    ticket_id = task.request.id
+    attempt = task.request.retries + 1
+    max_retries = TASK_MAX_RETRIES.get(task.name, MAX_RETRIES)
+
+    if not is_retryable_error(exc) or task.request.retries >= max_retries:
+        update_task_status(ticket_id, 'System Error', error_info=error_info)
+        logger.error(f"{task.name}任务失败，不再重试: ticket_id={ticket_id}, attempt={attempt}, 错误: {error_info}")
+        return {"error": error_info}
+
+    tried_servers = list(tried_servers or [])
+    if serv_name not in tried_servers:
+        tried_servers.append(serv_name)
+    # 优先换到没有失败过的服务器；都失败过或状态查询失败时仍在原服务器上退避重试，等待熔断器半开
+    try:
+        new_serv_name = get_available_server(exclude=tried_servers) or serv_name
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f"查询可用服务器失败，在原服务器上重试: ticket_id={ticket_id}, 错误: {str(e)}")
+        new_serv_name = serv_name
+    countdown = min(RETRY_BACKOFF_SECONDS * (2 ** task.request.retries), RETRY_BACKOFF_MAX_SECONDS)
+
+    switch_history = list(switch_history or [])
+    switch_history.append({
+        "switch_time": datetime.now().isoformat(),
+        "from_serv": serv_name,
+        "to_serv": new_serv_name,
+        "reason": f"任务执行失败，第{attempt}次重试",
+        "error": error_info,
+        "attempt": attempt
+    })
+    update_task_status(ticket_id, 'Queueing', error_info=error_info, serv_name=new_serv_name, serv_switch_info=json.dumps(switch_history))
+    logger.warning(f"{task.name}任务将在{countdown}秒后重试: ticket_id={ticket_id}, attempt={attempt}, new_serv_name={new_serv_name}")
+    raise task.retry(args=[task_params, user_id, new_serv_name],
+                     kwargs={'tried_servers': tried_servers, 'switch_history': switch_history},
+                     countdown=countdown,
+                     max_retries=max_retries,
+                     headers=tracing.inject_headers(ticket_id))
+
+def check_and_switch_server(ticket_id, original_serv_name, switch_history=None):
     """
     检查服务器状态并在必要时切换服务器
     
     :param ticket_id: 任务的ticket_id
     :param original_serv_name: 原始指定的服务器名称
+    :param switch_history: 之前的切换和重试记录（列表），切换服务器时原地追加新记录，
+                           serv_switch_info 写入完整列表
     :return: 元组 (server_name, status)
              server_name: 最终选定的服务器名称
              status: 'ready' 表示可以执行任务，'requeued' 表示任务需要重新排队
     """
+    with tracing.span('check_and_switch_server', ticket_id=ticket_id, serv_name=original_serv_name):
+        return _check_and_switch_server(ticket_id, original_serv_name,
+                                        switch_history if switch_history is not None else [])
+
+def _check_and_switch_server(ticket_id, original_serv_name, switch_history):
     try:
-        # 检查指定的服务器是否在线
-        server_status = get_server_status(original_serv_name)
+        # 检查指定的服务器是否在线，且没有被熔断
+        with tracing.span('get_server_status'):
+            server_status = get_server_status(original_serv_name)
         
-        if server_status == 'online':
+        if server_status == 'online' and circuit_breaker.allow_request(original_serv_name):
             # 如果服务器在线，直接返回
             logger.info(f"服务器 {original_serv_name} 在线，可以执行任务: ticket_id={ticket_id}")
             return original_serv_name, 'ready'
         else:
-            # 如果指定的服务器离线，尝试切换到其他可用服务器
-            logger.info(f"服务器 {original_serv_name} 离线，尝试切换服务器: ticket_id={ticket_id}")
-            new_serv_name = get_available_server(exclude=[original_serv_name])
+            # 如果指定的服务器离线或已熔断，尝试切换到其他可用服务器
+            reason = "原服务器离线" if server_status != 'online' else "原服务器已熔断"
+            logger.info(f"服务器 {original_serv_name} 不可用（{reason}），尝试切换服务器: ticket_id={ticket_id}")
+            with tracing.span('get_available_server'):
+                new_serv_name = get_available_server(exclude=[original_serv_name])
             
             if new_serv_name:
                 # 如果找到了新的可用服务器
-                if not is_server_busy(new_serv_name):
-                    # 如果新服务器不忙，更新任务信息
-                    serv_switch_info = {
+                with tracing.span('is_server_busy', serv_name=new_serv_name):
+                    new_serv_busy = is_server_busy(new_serv_name)
+                if not new_serv_busy and circuit_breaker.allow_request(new_serv_name):
+                    # 如果新服务器不忙且熔断器放行，更新任务信息
+                    switch_history.append({
                         "switch_time": datetime.now().isoformat(),
                         "from_serv": original_serv_name,
                         "to_serv": new_serv_name,
-                        "reason": "原服务器离线，切换到新服务器"
-                    }
-                    update_task_status(ticket_id, 'In Progress', serv_name=new_serv_name, serv_switch_info=json.dumps(serv_switch_info))
+                        "reason": f"{reason}，切换到新服务器"
+                    })
+                    update_task_status(ticket_id, 'In Progress', serv_name=new_serv_name, serv_switch_info=json.dumps(switch_history))
                     logger.info(f"任务切换到新服务器: ticket_id={ticket_id}, new_serv_name={new_serv_name}")
                     return new_serv_name, 'ready'
                 else:
                     # 如果新服务器忙，将任务重新排队
-                    serv_switch_info = {
+                    switch_history.append({
                         "switch_time": datetime.now().isoformat(),
                         "from_serv": original_serv_name,
                         "to_serv": new_serv_name,
-                        "reason": "原服务器离线，新服务器繁忙，任务重新排队"
-                    }
-                    update_task_status(ticket_id, 'Queueing', serv_name=new_serv_name, serv_switch_info=json.dumps(serv_switch_info))
+                        "reason": f"{reason}，新服务器繁忙，任务重新排队"
+                    })
+                    update_task_status(ticket_id, 'Queueing', serv_name=new_serv_name, serv_switch_info=json.dumps(switch_history))
                     logger.info(f"新服务器繁忙，任务重新排队: ticket_id={ticket_id}, new_serv_name={new_serv_name}")
                     return new_serv_name, 'requeued'
             else:
-                # 如果没有可用的服务器，将任务标记为错误
-                error_info = "没有可用的服务器"
-                update_task_status(ticket_id, 'System Error', error_info=error_info)
-                logger.error(f"没有可用的服务器，任务失败: ticket_id={ticket_id}")
-                raise Exception(error_info)
+                # 如果没有可用的服务器（例如都被熔断），交给调用方决定退避重试还是标记为错误
+                logger.error(f"没有可用的服务器: ticket_id={ticket_id}")
+                raise NoServerAvailable("没有可用的服务器")
     except Exception as e:
         logger.error(f"检查和切换服务器时出错: ticket_id={ticket_id}, 错误: {str(e)}")
         raise
@@ -212,12 +388,13 @@ def check_and_switch_server(ticket_id, original_serv_name):
 # 然后，我们可以在每个任务中使用这个函数：
 
 @app.task(name='Image Creation', bind=True)
-def image_creation(self, task_params, user_id, serv_name):
+def image_creation(self, task_params, user_id, serv_name, tried_servers=None, switch_history=None):
     ticket_id = self.request.id
     logger.info(f"开始执行Image Creation任务,ticket_id: {ticket_id}, serv_name: {serv_name}")
     
+    switch_history = list(switch_history or [])
     try:
-        serv_name, status = check_and_switch_server(ticket_id, serv_name)
+        serv_name, status = check_and_switch_server(ticket_id, serv_name, switch_history)
         if status == 'requeued':
             return {"status": "requeued"}
         
@@ -230,32 +407,29 @@ def image_creation(self, task_params, user_id, serv_name):
         task_params['serv_name'] = serv_name
         
         # 调用AI服务器API
-        response = requests.post(f"{AI_SERVER_URL}/image_creation", json=task_params, timeout=300)
-        response.raise_for_status()
+        response = call_ai_server(serv_name, '/image_creation', task_params)
         
         # 解析返回的文件列表
         result_info = {"image_urls": response.json()}
         update_task_status(ticket_id, 'Completed', result_info=json.dumps(result_info))
         logger.info(f"Image Creation任务完成: ticket_id={ticket_id}")
         return result_info
-    except requests.Timeout:
-        error_info = "AI服务器请求超时"
-        update_task_status(ticket_id, 'System Error', error_info=error_info)
+    except (requests.Timeout, SoftTimeLimitExceeded) as e:
         logger.error(f"Image Creation任务超时: ticket_id={ticket_id}")
-        return {"error": error_info}
+        return retry_or_fail(self, serv_name, task_params, user_id, e, "AI服务器请求超时", tried_servers, switch_history)
     except Exception as e:
         error_info = str(e)
-        update_task_status(ticket_id, 'System Error', error_info=error_info)
         logger.error(f"Image Creation任务处理过程中出错: ticket_id={ticket_id}, 错误: {error_info}")
-        return {"error": error_info}
+        return retry_or_fail(self, serv_name, task_params, user_id, e, error_info, tried_servers, switch_history)
 
 @app.task(name='Image Upscale', bind=True)
-def image_upscale(self, task_params, user_id, serv_name):
+def image_upscale(self, task_params, user_id, serv_name, tried_servers=None, switch_history=None):
     ticket_id = self.request.id
     logger.info(f"开始执行Image Upscale任务,ticket_id: {ticket_id}, serv_name: {serv_name}")
     
+    switch_history = list(switch_history or [])
     try:
-        serv_name, status = check_and_switch_server(ticket_id, serv_name)
+        serv_name, status = check_and_switch_server(ticket_id, serv_name, switch_history)
         if status == 'requeued':
             return {"status": "requeued"}
         
@@ -268,32 +442,29 @@ def image_upscale(self, task_params, user_id, serv_name):
         task_params['serv_name'] = serv_name
 
         # 调用AI服务器API
-        response = requests.post(f"{AI_SERVER_URL}/image_upscale", json=task_params, timeout=300)
-        response.raise_for_status()
+        response = call_ai_server(serv_name, '/image_upscale', task_params)
 
         # 解析返回的文件列表
         result_info = {"image_urls": response.json()}
         update_task_status(ticket_id, 'Completed', result_info=json.dumps(result_info))
         logger.info(f"Image Upscale任务完成: ticket_id={ticket_id}")
         return result_info
-    except requests.Timeout:
-        error_info = "AI服务器请求超时"
-        update_task_status(ticket_id, 'System Error', error_info=error_info)
+    except (requests.Timeout, SoftTimeLimitExceeded) as e:
         logger.error(f"Image Upscale任务超时: ticket_id={ticket_id}")
-        return {"error": error_info}
+        return retry_or_fail(self, serv_name, task_params, user_id, e, "AI服务器请求超时", tried_servers, switch_history)
     except Exception as e:
         error_info = str(e)
-        update_task_status(ticket_id, 'System Error', error_info=error_info)
         logger.error(f"Image Upscale任务处理过程中出错: ticket_id={ticket_id}, 错误: {error_info}")
-        return {"error": error_info}
+        return retry_or_fail(self, serv_name, task_params, user_id, e, error_info, tried_servers, switch_history)
 
 @app.task(name='Face Swap', bind=True)
-def face_swap(self, task_params, user_id, serv_name):
+def face_swap(self, task_params, user_id, serv_name, tried_servers=None, switch_history=None):
     ticket_id = self.request.id
     logger.info(f"开始执行Face Swap任务,ticket_id: {ticket_id}, serv_name: {serv_name}")
     
+    switch_history = list(switch_history or [])
     try:
-        serv_name, status = check_and_switch_server(ticket_id, serv_name)
+        serv_name, status = check_and_switch_server(ticket_id, serv_name, switch_history)
         if status == 'requeued':
             return {"status": "requeued"}
         
@@ -306,24 +477,20 @@ def face_swap(self, task_params, user_id, serv_name):
         task_params['serv_name'] = serv_name
 
         # 调用AI服务器API
-        response = requests.post(f"{AI_SERVER_URL}/face_swap", json=task_params, timeout=300)
-        response.raise_for_status()
+        response = call_ai_server(serv_name, '/face_swap', task_params)
 
         # 解析返回的文件列表
         result_info = {"image_urls": response.json()}
         update_task_status(ticket_id, 'Completed', result_info=json.dumps(result_info))
         logger.info(f"Face Swap任务完成: ticket_id={ticket_id}")
         return result_info
-    except requests.Timeout:
-        error_info = "AI服务器请求超时"
-        update_task_status(ticket_id, 'System Error', error_info=error_info)
+    except (requests.Timeout, SoftTimeLimitExceeded) as e:
         logger.error(f"Face Swap任务超时: ticket_id={ticket_id}")
-        return {"error": error_info}
+        return retry_or_fail(self, serv_name, task_params, user_id, e, "AI服务器请求超时", tried_servers, switch_history)
     except Exception as e:
         error_info = str(e)
-        update_task_status(ticket_id, 'System Error', error_info=error_info)
         logger.error(f"Face Swap任务处理过程中出错: ticket_id={ticket_id}, 错误: {error_info}")
-        return {"error": error_info}
+        return retry_or_fail(self, serv_name, task_params, user_id, e, error_info, tried_servers, switch_history)
 
 @app.task(name='Video Creation', bind=True)
 def video_creation(self, task_params, serv_name):
@@ -380,12 +547,50 @@ def process_task_queue():
     cursor.close()
     conn.close()
 
+@app.task
+def update_eta_statistics():
+    """增量更新各任务类型在各服务器上的执行耗时统计"""
+    try:
+        conn = get_db_connection()
+        try:
+            processed = eta_estimator.refresh_stats(conn)
+        finally:
+            conn.close()
+        logger.info(f"已更新任务耗时统计: {processed}条")
+    except Exception as e:
+        logger.error(f"更新任务耗时统计时出错: {str(e)}")
+
+@app.task
+def flush_task_status_updates():
+    """把队列中的任务状态变更批量写入数据库"""
+    try:
+        flushed = status_writer.flush(get_db_connection)
+        if flushed:
+            logger.info(f"已批量写入任务状态变更: {flushed}条")
+    except Exception as e:
+        # 未写入的变更仍在 pending 列表中，下次执行时重试
+        logger.error(f"批量写入任务状态变更时出错: {str(e)}")
+
 # 设置定时任务来处理队列
 app.conf.beat_schedule['process-task-queue-every-minute'] = {
     'task': 'celery_tasks.process_task_queue',
     'schedule': crontab(minute='*'),
 }
 
+# 每个 worker 进程的 BackgroundFlusher 已经在定时写库；beat 触发的任务只是补充
+# （例如使用 solo/threads 池时不会触发 worker_process_init）
+app.conf.beat_schedule['flush-task-status-updates'] = {
+    'task': 'celery_tasks.flush_task_status_updates',
+    'schedule': timedelta(seconds=status_writer.STATUS_FLUSH_INTERVAL),
+    # 维护 worker 来不及处理时丢弃过期的触发消息，不在 broker 中堆积
+    'options': {'expires': status_writer.STATUS_FLUSH_INTERVAL * 5},
+}
+
+app.conf.beat_schedule['update-eta-statistics-every-minute'] = {
+    'task': 'celery_tasks.update_eta_statistics',
+    'schedule': crontab(minute='*'),
+}
+
 # 配置Celery
 app.conf.update(
     task_serializer='json',
@@ -394,7 +599,11 @@ app.conf.update(
     timezone='UTC',
     enable_utc=True,
     task_track_started=True,
-    task_time_limit=int(os.getenv('TASK_TIMEOUT_SECONDS', 300)),
+    task_time_limit=TASK_TIMEOUT_SECONDS,
+    task_soft_time_limit=TASK_SOFT_TIMEOUT_SECONDS,
     worker_max_tasks_per_child=int(os.getenv('WORKER_MAX_TASKS', 100)),
+    task_routes=TASK_ROUTES,
+    # AI 任务耗时长，每个 worker 进程只预取一个任务
+    worker_prefetch_multiplier=1,
     broker_connection_retry_on_startup=True
 )
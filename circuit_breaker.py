@@ -0,0 +1,242 @@
+# encoding: utf-8
+"""
+AI服务器熔断器
+
+根据真实任务结果（超时、5xx、慢请求）统计每台AI服务器的错误率，
+错误率超过阈值时熔断（open），冷却后进入半开（half_open）状态放行少量试探任务，
+试探成功后恢复（closed）。状态保存在Redis中，由所有worker和网关进程共享，
+每次读取和修改都在 WATCH/MULTI 事务中完成，多个进程并发时不会多放行试探任务。
+"""
+import logging
+import os
+import time
+
+import redis
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+CB_KEY_PREFIX = 'circuit_breaker:'
+CB_WINDOW_SECONDS = int(os.getenv('CB_WINDOW_SECONDS', 60))
+CB_MIN_REQUESTS = int(os.getenv('CB_MIN_REQUESTS', 5))
+CB_FAILURE_RATE_THRESHOLD = float(os.getenv('CB_FAILURE_RATE_THRESHOLD', 0.5))
+# 慢请求阈值需要明显小于 AI 请求超时（默认取一半），否则超时之前完成的调用永远不会被计为慢请求
+_TASK_TIMEOUT_SECONDS = int(os.getenv('TASK_TIMEOUT_SECONDS', 300))
+_AI_REQUEST_TIMEOUT_SECONDS = float(os.getenv('AI_REQUEST_TIMEOUT_SECONDS', _TASK_TIMEOUT_SECONDS - 60))
+CB_SLOW_CALL_SECONDS = float(os.getenv('CB_SLOW_CALL_SECONDS', _AI_REQUEST_TIMEOUT_SECONDS / 2))
+CB_OPEN_SECONDS = int(os.getenv('CB_OPEN_SECONDS', 120))
+CB_HALF_OPEN_MAX_TRIALS = int(os.getenv('CB_HALF_OPEN_MAX_TRIALS', 1))
+CB_HALF_OPEN_SUCCESSES = int(os.getenv('CB_HALF_OPEN_SUCCESSES', 2))
+# 试探任务多久没有结果视为丢失并释放名额，需要大于任务的硬超时时间
+CB_TRIAL_TIMEOUT_SECONDS = int(os.getenv('CB_TRIAL_TIMEOUT_SECONDS', _TASK_TIMEOUT_SECONDS + 60))
+
+_redis_client = None
+
+
+def _get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(
+            host=os.getenv('REDIS_HOST', 'localhost'),
+            port=int(os.getenv('REDIS_PORT', 6379)),
+            db=int(os.getenv('REDIS_DB_CIRCUIT_BREAKER', 2)),
+            decode_responses=True
+        )
+    return _redis_client
+
+
+def _key(serv_name):
+    return f"{CB_KEY_PREFIX}{serv_name}"
+
+
+def _load(client, serv_name):
+    data = client.hgetall(_key(serv_name)) or {}
+    return {
+        'state': data.get('state', STATE_CLOSED),
+        'opened_at': float(data.get('opened_at', 0)),
+        'window_start': float(data.get('window_start', 0)),
+        'calls': int(data.get('calls', 0)),
+        'failures': int(data.get('failures', 0)),
+        'trials': int(data.get('trials', 0)),
+        'trial_started_at': float(data.get('trial_started_at', 0)),
+        'trial_successes': int(data.get('trial_successes', 0)),
+    }
+
+
+def _reset(info, state, now):
+    """切换熔断器状态，并重置窗口和试探计数"""
+    info.update({
+        'state': state,
+        'opened_at': now if state != STATE_CLOSED else 0,
+        'window_start': now,
+        'calls': 0,
+        'failures': 0,
+        'trials': 0,
+        'trial_started_at': 0,
+        'trial_successes': 0,
+    })
+
+
+def _advance(info, now):
+    """按时间推进状态：open 冷却结束转为 half_open；试探任务超时未返回结果时释放试探名额"""
+    if info['state'] == STATE_OPEN and now - info['opened_at'] >= CB_OPEN_SECONDS:
+        _reset(info, STATE_HALF_OPEN, now)
+    elif (info['state'] == STATE_HALF_OPEN and info['trials'] > 0
+          and now - info['trial_started_at'] >= CB_TRIAL_TIMEOUT_SECONDS):
+        # 最近一个试探任务已超过任务超时时间（例如worker崩溃），之前的试探任务也不会再有结果
+        info['trials'] = 0
+        info['trial_started_at'] = 0
+
+
+def _update(client, serv_name, now, apply):
+    """
+    在 WATCH/MULTI 事务中读取状态、推进状态并写回变化的字段，其他进程并发修改时自动重试
+
+    :param apply: 接收状态字典、原地修改并返回结果的函数
+    :return: apply 的返回值
+    """
+    key = _key(serv_name)
+
+    def execute(pipe):
+        info = _load(pipe, serv_name)
+        original = dict(info)
+        _advance(info, now)
+        result = apply(info)
+        changed = {field: value for field, value in info.items() if value != original[field]}
+        pipe.multi()
+        if changed:
+            pipe.hset(key, mapping=changed)
+        return result, original['state'], info['state']
+
+    # 日志在事务提交之后输出，冲突重试时不会重复
+    result, old_state, new_state = client.transaction(execute, key, value_from_callable=True)
+    if old_state != new_state:
+        logger.warning(f"熔断器状态变更: serv_name={serv_name}, state={new_state}")
+    return result
+
+
+def get_state(serv_name):
+    """
+    获取服务器的熔断器状态
+
+    :param serv_name: 服务器名称
+    :return: 'closed'、'open' 或 'half_open'；Redis不可用时返回 'closed'
+    """
+    try:
+        return _update(_get_redis(), serv_name, time.time(), lambda info: info['state'])
+    except redis.RedisError as e:
+        logger.warning(f"读取熔断器状态失败: serv_name={serv_name}, 错误: {str(e)}")
+        return STATE_CLOSED
+
+
+def is_available(serv_name):
+    """
+    判断服务器是否可以参与任务分配（不占用半开试探名额）
+
+    :param serv_name: 服务器名称
+    :return: closed，或 half_open 且仍有试探名额时返回 True
+    """
+    try:
+        return _update(_get_redis(), serv_name, time.time(), _has_capacity)
+    except redis.RedisError as e:
+        logger.warning(f"读取熔断器状态失败: serv_name={serv_name}, 错误: {str(e)}")
+        return True
+
+
+def _has_capacity(info):
+    if info['state'] == STATE_CLOSED:
+        return True
+    if info['state'] == STATE_HALF_OPEN:
+        return info['trials'] < CB_HALF_OPEN_MAX_TRIALS
+    return False
+
+
+def allow_request(serv_name):
+    """
+    在真正向服务器发送任务之前调用，half_open 状态下会占用一个试探名额
+
+    :param serv_name: 服务器名称
+    :return: 是否允许向该服务器发送任务
+    """
+    now = time.time()
+
+    def acquire(info):
+        if info['state'] != STATE_HALF_OPEN:
+            return info['state'] == STATE_CLOSED, False
+        if info['trials'] >= CB_HALF_OPEN_MAX_TRIALS:
+            return False, False
+        info['trials'] += 1
+        info['trial_started_at'] = now
+        return True, True
+
+    try:
+        allowed, is_trial = _update(_get_redis(), serv_name, now, acquire)
+    except redis.RedisError as e:
+        logger.warning(f"熔断器检查失败，默认放行: serv_name={serv_name}, 错误: {str(e)}")
+        return True
+    if is_trial:
+        logger.info(f"熔断器半开试探: serv_name={serv_name}")
+    return allowed
+
+
+def record_success(serv_name, latency=None):
+    """
+    记录一次成功的任务调用；耗时超过 CB_SLOW_CALL_SECONDS 的调用按失败计
+
+    :param serv_name: 服务器名称
+    :param latency: 调用耗时（秒）
+    """
+    if latency is not None and latency >= CB_SLOW_CALL_SECONDS:
+        record_failure(serv_name, reason=f"慢请求: {latency:.1f}s")
+        return
+    _record(serv_name, success=True)
+
+
+def record_failure(serv_name, reason=None):
+    """
+    记录一次失败的任务调用（超时、连接错误、5xx）
+
+    :param serv_name: 服务器名称
+    :param reason: 失败原因，仅用于日志
+    """
+    logger.info(f"熔断器记录失败: serv_name={serv_name}, reason={reason}")
+    _record(serv_name, success=False)
+
+
+def _record(serv_name, success):
+    now = time.time()
+
+    def apply(info):
+        if info['state'] == STATE_HALF_OPEN:
+            if not success:
+                _reset(info, STATE_OPEN, now)
+                return
+            # 名额可能已因超时被释放，不能减到负数，否则会多放行试探任务
+            info['trials'] = max(info['trials'] - 1, 0)
+            info['trial_successes'] += 1
+            if info['trial_successes'] >= CB_HALF_OPEN_SUCCESSES:
+                _reset(info, STATE_CLOSED, now)
+            return
+
+        if info['state'] == STATE_OPEN:
+            # 熔断前已发出的任务，结果不再影响状态
+            return
+
+        if now - info['window_start'] >= CB_WINDOW_SECONDS:
+            info.update({'window_start': now, 'calls': 0, 'failures': 0})
+        info['calls'] += 1
+        info['failures'] += 0 if success else 1
+        if info['calls'] >= CB_MIN_REQUESTS and info['failures'] / info['calls'] >= CB_FAILURE_RATE_THRESHOLD:
+            _reset(info, STATE_OPEN, now)
+
+    try:
+        _update(_get_redis(), serv_name, now, apply)
+    except redis.RedisError as e:
+        logger.warning(f"熔断器记录结果失败: serv_name={serv_name}, 错误: {str(e)}")
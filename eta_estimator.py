@@ -0,0 +1,195 @@
+# encoding: utf-8
+"""
+排队任务的预计开始/完成时间估算
+
+按 task_type × serv_name 维护任务执行耗时的指数加权均值和方差（EWMA），
+由定时任务从 sride_queue 中增量读取新完成任务的 started_at/completed_at 更新，
+只重读最近一段时间内的数据以补上延迟写库的任务，不会重复扫描历史数据。查询任务时结合目标服务器当前的积压任务给出预计时间。
+"""
+import logging
+import math
+import os
+from datetime import datetime, timedelta
+
+import redis
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ETA_KEY_PREFIX = 'eta_stats:'
+ETA_WATERMARK_KEY = 'eta_stats_watermark'
+ETA_SEEN_KEY_PREFIX = 'eta_stats_seen:'
+ETA_EWMA_ALPHA = float(os.getenv('ETA_EWMA_ALPHA', 0.2))
+ETA_DEFAULT_SECONDS = float(os.getenv('ETA_DEFAULT_SECONDS', 60))
+ETA_SERVER_CONCURRENCY = int(os.getenv('ETA_SERVER_CONCURRENCY', 1))
+ETA_REFRESH_BATCH_SIZE = int(os.getenv('ETA_REFRESH_BATCH_SIZE', 1000))
+ETA_REFRESH_LAG_SECONDS = int(os.getenv('ETA_REFRESH_LAG_SECONDS', 600))
+POLL_INTERVAL_MIN_SECONDS = int(os.getenv('POLL_INTERVAL_MIN_SECONDS', 2))
+POLL_INTERVAL_MAX_SECONDS = int(os.getenv('POLL_INTERVAL_MAX_SECONDS', 60))
+
+_redis_client = None
+
+
+def _get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(
+            host=os.getenv('REDIS_HOST', 'localhost'),
+            port=int(os.getenv('REDIS_PORT', 6379)),
+            db=int(os.getenv('REDIS_DB_STATS', 2)),
+            decode_responses=True
+        )
+    return _redis_client
+
+
+def _key(task_type, serv_name):
+    return f"{ETA_KEY_PREFIX}{task_type}:{serv_name}"
+
+
+def record_duration(task_type, serv_name, seconds):
+    """
+    用一次任务执行耗时更新 EWMA 均值和方差
+
+    :param task_type: 任务类型
+    :param serv_name: 执行任务的服务器名称
+    :param seconds: 执行耗时（秒）
+    """
+    client = _get_redis()
+    key = _key(task_type, serv_name)
+    data = client.hgetall(key)
+
+    if not data:
+        mean, var, count = float(seconds), 0.0, 1
+    else:
+        mean, var, count = float(data['mean']), float(data['var']), int(data['count']) + 1
+        diff = seconds - mean
+        incr = ETA_EWMA_ALPHA * diff
+        mean = mean + incr
+        var = (1 - ETA_EWMA_ALPHA) * (var + diff * incr)
+
+    client.hset(key, mapping={'mean': mean, 'var': var, 'count': count})
+
+
+def get_duration_stats(task_type, serv_name):
+    """
+    获取任务执行耗时的估计值
+
+    :return: 元组 (mean, std)，没有历史数据时返回 (ETA_DEFAULT_SECONDS, 0)
+    """
+    try:
+        data = _get_redis().hgetall(_key(task_type, serv_name))
+    except redis.RedisError as e:
+        logger.warning(f"读取耗时统计失败: task_type={task_type}, serv_name={serv_name}, 错误: {str(e)}")
+        data = None
+    if not data:
+        return ETA_DEFAULT_SECONDS, 0.0
+    return float(data['mean']), math.sqrt(max(float(data['var']), 0.0))
+
+
+def refresh_stats(conn, now=None):
+    """
+    从 sride_queue 增量读取新完成的任务，更新耗时统计
+
+    状态是批量异步写库的，completed_at 早于水位的任务可能稍后才出现在表中。
+    每次从 min(水位, now - ETA_REFRESH_LAG_SECONDS) 开始重新读取，已统计过的任务按 ticket_id 跳过。
+
+    :param conn: 数据库连接
+    :param now: 当前时间，默认 datetime.now()
+    :return: 本次新统计的任务数，每次最多约 ETA_REFRESH_BATCH_SIZE 条
+    """
+    client = _get_redis()
+    now = now or datetime.now()
+    last_completed_at = client.hgetall(ETA_WATERMARK_KEY).get('completed_at', '1970-01-01 00:00:00')
+    lag_start = (now - timedelta(seconds=ETA_REFRESH_LAG_SECONDS)).strftime('%Y-%m-%d %H:%M:%S')
+    position = (min(last_completed_at, lag_start), '')
+
+    select_query = """
+    SELECT ticket_id, task_type, serv_name, started_at, completed_at
+    FROM sride_queue
+    WHERE status = 'Completed'
+      AND started_at IS NOT NULL
+      AND (completed_at, ticket_id) > (%s, %s)
+    ORDER BY completed_at, ticket_id
+    LIMIT %s
+    """
+    recorded = 0
+    cursor = conn.cursor(dictionary=True)
+    try:
+        while recorded < ETA_REFRESH_BATCH_SIZE:
+            cursor.execute(select_query, (*position, ETA_REFRESH_BATCH_SIZE))
+            rows = cursor.fetchall()
+            for row in rows:
+                # 标记的有效期覆盖任务留在重读窗口内的时间
+                if not client.set(f"{ETA_SEEN_KEY_PREFIX}{row['ticket_id']}", 1,
+                                  nx=True, ex=ETA_REFRESH_LAG_SECONDS * 2):
+                    continue
+                seconds = (row['completed_at'] - row['started_at']).total_seconds()
+                if seconds >= 0:
+                    record_duration(row['task_type'], row['serv_name'], seconds)
+                recorded += 1
+            if rows:
+                position = (rows[-1]['completed_at'].strftime('%Y-%m-%d %H:%M:%S'), rows[-1]['ticket_id'])
+            if len(rows) < ETA_REFRESH_BATCH_SIZE:
+                break
+    finally:
+        cursor.close()
+
+    if position[0] > last_completed_at:
+        client.hset(ETA_WATERMARK_KEY, mapping={'completed_at': position[0]})
+    return recorded
+
+
+def suggest_poll_interval(remaining_seconds):
+    """根据剩余时间给出建议的轮询间隔（秒）"""
+    interval = int(remaining_seconds / 4)
+    return max(POLL_INTERVAL_MIN_SECONDS, min(interval, POLL_INTERVAL_MAX_SECONDS))
+
+
+def estimate(cursor, task_info, now=None):
+    """
+    估算任务的开始和完成时间
+
+    :param cursor: 数据库游标（dictionary=True）
+    :param task_info: sride_queue 中该任务的记录
+    :param now: 当前时间，默认 datetime.now()
+    :return: 包含 estimated_start、estimated_completion、poll_interval 的字典
+    """
+    now = now or datetime.now()
+    stats = {}
+
+    def mean_for(task_type):
+        if task_type not in stats:
+            stats[task_type] = get_duration_stats(task_type, task_info['serv_name'])[0]
+        return stats[task_type]
+
+    own_duration = mean_for(task_info['task_type'])
+
+    if task_info['status'] == 'In Progress' and task_info['started_at']:
+        start = task_info['started_at']
+    else:
+        # 同一服务器上排在前面的任务（进行中 + 更早排队）
+        backlog_query = """
+        SELECT task_type, status, started_at
+        FROM sride_queue
+        WHERE serv_name = %s AND ticket_id != %s
+          AND (status = 'In Progress' OR (status = 'Queueing' AND created_at < %s))
+        """
+        cursor.execute(backlog_query, (task_info['serv_name'], task_info['ticket_id'], task_info['created_at']))
+        backlog_seconds = 0.0
+        for row in cursor.fetchall():
+            duration = mean_for(row['task_type'])
+            if row['status'] == 'In Progress' and row['started_at']:
+                duration = max(duration - (now - row['started_at']).total_seconds(), 0.0)
+            backlog_seconds += duration
+        start = now + timedelta(seconds=backlog_seconds / max(ETA_SERVER_CONCURRENCY, 1))
+
+    completion = max(start + timedelta(seconds=own_duration), now)
+
+    return {
+        "estimated_start": start.isoformat(),
+        "estimated_completion": completion.isoformat(),
+        "poll_interval": suggest_poll_interval((completion - now).total_seconds())
+    }
@@ -0,0 +1,40 @@
+# encoding: utf-8
+# 生产环境启动网关：gunicorn -c gunicorn.conf.py back_serv:flask_app
+# 平滑重载：kill -HUP <master pid>（或 systemctl reload backserv.service），逐个用新代码替换 worker，不中断监听
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+bind = f"{os.getenv('FLASK_HOST', '0.0.0.0')}:{os.getenv('FLASK_PORT', 4093)}"
+
+# 接口大部分时间在等待 MySQL、Redis 和 AI 服务器，使用多线程 worker
+worker_class = 'gthread'
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# 默认不预先导入应用：每个 worker 自己导入代码，HUP 重载时会加载新代码。
+# 连接池、HTTP会话和 Celery 生产者本来就在 worker 中按需创建，preload 节省的只是导入时间。
+# GUNICORN_PRELOAD=1 时 HUP 不会加载新代码，更新代码后需要 systemctl restart。
+preload_app = os.getenv('GUNICORN_PRELOAD', '0') == '1'
+
+# /translator、/promptor 会同步等待 Dify 返回
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# 定期替换 worker，避免长时间运行后的内存增长
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.getenv('GUNICORN_ERROR_LOG', '-')
+loglevel = os.getenv('LOG_LEVEL', 'INFO').lower()
+
+
+def post_fork(server, worker):
+    import back_serv
+    back_serv.reset_after_fork()
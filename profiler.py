@@ -0,0 +1,134 @@
+# encoding: utf-8
+"""
+采样分析器
+
+定时采集进程内所有线程的调用栈，输出 collapsed stack 格式（每行 "frame1;frame2;... 次数"），
+可以直接交给 flamegraph.pl 或 speedscope 生成火焰图。默认关闭（PROFILER_ENABLED=1 开启）。
+"""
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', '0') == '1'
+PROFILER_INTERVAL_SECONDS = float(os.getenv('PROFILER_INTERVAL_SECONDS', 0.01))
+PROFILER_MAX_SECONDS = int(os.getenv('PROFILER_MAX_SECONDS', 60))
+PROFILER_OUTPUT_DIR = os.getenv('PROFILER_OUTPUT_DIR', 'profiles')
+PROFILER_DUMP_INTERVAL = int(os.getenv('PROFILER_DUMP_INTERVAL', 60))
+# /debug/profile 需要在 X-Profiler-Token 请求头中携带该令牌；未设置时该接口不可用
+PROFILER_TOKEN = os.getenv('PROFILER_TOKEN')
+
+# 同一进程同时只运行一次按需采样
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(RuntimeError):
+    """已有采样正在进行"""
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class StackSampler:
+    """
+    在后台线程中定时采样调用栈
+
+    :param interval: 采样间隔（秒）
+    :param dump_path: 设置后每隔 dump_interval 秒把累计结果写入该文件
+    :param dump_interval: 写文件的间隔（秒）
+    """
+
+    def __init__(self, interval=PROFILER_INTERVAL_SECONDS, dump_path=None, dump_interval=PROFILER_DUMP_INTERVAL):
+        self.interval = interval
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.dump_path:
+            self.dump()
+
+    def sample(self):
+        own_thread_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread_id:
+                continue
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def collapsed(self):
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def dump(self):
+        os.makedirs(os.path.dirname(self.dump_path) or '.', exist_ok=True)
+        with open(self.dump_path, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+
+    def _run(self):
+        last_dump = time.monotonic()
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+            if self.dump_path and time.monotonic() - last_dump >= self.dump_interval:
+                self.dump()
+                last_dump = time.monotonic()
+
+
+def profile(seconds):
+    """
+    采样当前进程指定的秒数，返回 collapsed stack 文本
+
+    :param seconds: 采样时长，必须大于 0，超过 PROFILER_MAX_SECONDS 时按 PROFILER_MAX_SECONDS 计
+    :raises ValueError: 采样时长不是正数
+    :raises ProfilerBusyError: 已有采样正在进行
+    """
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError("采样时长必须是正数")
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("已有采样正在进行")
+    try:
+        sampler = StackSampler()
+        sampler.start()
+        time.sleep(min(seconds, PROFILER_MAX_SECONDS))
+        sampler.stop()
+        return sampler.collapsed()
+    finally:
+        _profile_lock.release()
+
+
+def start_background_profiler(process_name):
+    """
+    开启持续采样，结果定期写入 PROFILER_OUTPUT_DIR/<process_name>-<pid>.folded
+
+    :return: StackSampler，未开启时返回 None
+    """
+    if not PROFILER_ENABLED:
+        return None
+    dump_path = os.path.join(PROFILER_OUTPUT_DIR, f"{process_name}-{os.getpid()}.folded")
+    sampler = StackSampler(dump_path=dump_path)
+    sampler.start()
+    logger.info(f"已开启采样分析: {dump_path}")
+    return sampler
@@ -3,5 +3,15 @@
 # 重启 celery.service
 sudo systemctl restart celery.service
 
+# 重启维护 worker（-Q maintenance）和 celery beat
+sudo systemctl restart celery-maintenance.service
+sudo systemctl restart celery-beat.service
+
+# 平滑重载网关：gunicorn 收到 HUP 后用新代码逐个替换 worker，监听端口不关闭
+sudo systemctl reload backserv.service
+
 # 检查服务状态并自动退出
 sudo systemctl status celery.service | tee /dev/null
+sudo systemctl status celery-maintenance.service | tee /dev/null
+sudo systemctl status celery-beat.service | tee /dev/null
+sudo systemctl status backserv.service | tee /dev/null
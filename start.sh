@@ -3,5 +3,15 @@
 # 启动 celery.service
 sudo systemctl start celery.service
 
+# 启动维护 worker（-Q maintenance）和 celery beat
+sudo systemctl start celery-maintenance.service
+sudo systemctl start celery-beat.service
+
+# 启动 backserv.service（gunicorn 网关）
+sudo systemctl start backserv.service
+
 # 检查服务状态并自动退出
 sudo systemctl status celery.service | tee /dev/null
+sudo systemctl status celery-maintenance.service | tee /dev/null
+sudo systemctl status celery-beat.service | tee /dev/null
+sudo systemctl status backserv.service | tee /dev/null
@@ -0,0 +1,334 @@
+# encoding: utf-8
+"""
+任务状态的异步批量写入
+
+worker 不再每次状态变更都单独连接数据库，而是把状态变更写入 Redis Stream，
+由定时任务统一读取，按 ticket_id 合并后在一个事务里批量更新 sride_queue。
+
+- 顺序：同一时间只有一个 flusher（Redis 锁），按 Stream 顺序合并，保证同一任务的变更按发生顺序生效
+- 单调：任务进入终态（Completed / Cancelled / System Error）后不会再被覆盖
+- 持久：写库成功后才 XACK；数据库临时故障时变更留在 pending 列表中，下次 flush 时重试
+- 隔离：整批写入失败时逐个任务重试，被数据库拒绝（或投递次数过多）的变更移入死信 Stream，不会阻塞其他任务
+- 不依赖额外进程：每个 worker 进程都运行 BackgroundFlusher 线程，只要有 worker 在运行，变更就会写入数据库
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+
+import mysql.connector
+import redis
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('Completed', 'Cancelled', 'System Error')
+
+STATUS_STREAM_KEY = 'task_status_updates'
+STATUS_DEAD_LETTER_KEY = 'task_status_updates_dead'
+STATUS_GROUP_NAME = 'status_flusher'
+STATUS_CONSUMER_NAME = 'flusher'
+STATUS_FLUSH_LOCK_KEY = 'task_status_flush_lock'
+STATUS_FLUSH_INTERVAL = float(os.getenv('STATUS_FLUSH_INTERVAL', 2))
+STATUS_FLUSH_BATCH_SIZE = int(os.getenv('STATUS_FLUSH_BATCH_SIZE', 500))
+STATUS_FLUSH_LOCK_SECONDS = int(os.getenv('STATUS_FLUSH_LOCK_SECONDS', 30))
+STATUS_FLUSH_MAX_DELIVERIES = int(os.getenv('STATUS_FLUSH_MAX_DELIVERIES', 20))
+
+_redis_client = None
+
+
+def _get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(
+            host=os.getenv('REDIS_HOST', 'localhost'),
+            port=int(os.getenv('REDIS_PORT', 6379)),
+            db=int(os.getenv('REDIS_DB_STATS', 2)),
+            decode_responses=True
+        )
+    return _redis_client
+
+
+def enqueue_status(ticket_id, status, result_info=None, error_info=None, serv_name=None, serv_switch_info=None):
+    """
+    把一次状态变更写入 Redis Stream，等待批量写库
+
+    :raises redis.RedisError: Redis 不可用时抛出，由调用方改为直接写库
+    """
+    update = {
+        "ticket_id": ticket_id,
+        "status": status,
+        "result_info": result_info,
+        "error_info": error_info,
+        "serv_name": serv_name,
+        "serv_switch_info": serv_switch_info,
+        "event_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    _get_redis().xadd(STATUS_STREAM_KEY, {"data": json.dumps(update)})
+
+
+def merge_updates(updates):
+    """
+    按 ticket_id 合并状态变更，updates 需按发生顺序排列
+
+    status / result_info / error_info 取最后一次变更的值，与逐条 UPDATE 的结果一致；
+    serv_name / serv_switch_info 取最后一次非空值；
+    started_at / completed_at 取对应状态变更发生的时间。
+    进入终态之后的变更会被丢弃。
+
+    :return: {ticket_id: 合并后的变更}，保持首次出现的顺序
+    """
+    merged = {}
+    for update in updates:
+        row = merged.get(update['ticket_id'])
+        if row is None:
+            row = merged[update['ticket_id']] = {
+                "status": None,
+                "result_info": None,
+                "error_info": None,
+                "started_at": None,
+                "completed_at": None,
+                "serv_name": None,
+                "serv_switch_info": None
+            }
+        elif row['status'] in TERMINAL_STATUSES:
+            logger.warning(f"忽略终态之后的状态变更: ticket_id={update['ticket_id']}, "
+                           f"status={update['status']}, current={row['status']}")
+            continue
+
+        row['status'] = update['status']
+        row['result_info'] = update['result_info']
+        row['error_info'] = update['error_info']
+        if update['status'] == 'In Progress':
+            row['started_at'] = update['event_time']
+        if update['status'] in TERMINAL_STATUSES:
+            row['completed_at'] = update['event_time']
+        if update['serv_name'] is not None:
+            row['serv_name'] = update['serv_name']
+        if update['serv_switch_info'] is not None:
+            row['serv_switch_info'] = update['serv_switch_info']
+    return merged
+
+
+def write_updates(conn, merged):
+    """
+    在一个事务中批量写入合并后的状态变更，已处于终态的任务不会被覆盖
+
+    :param conn: 数据库连接
+    :param merged: merge_updates 的返回值
+    """
+    update_query = """
+    UPDATE sride_queue
+    SET status = %s,
+        result_info = %s,
+        error_info = %s,
+        started_at = COALESCE(%s, started_at),
+        completed_at = COALESCE(%s, completed_at),
+        serv_name = COALESCE(%s, serv_name),
+        serv_switch_info = COALESCE(%s, serv_switch_info)
+    WHERE ticket_id = %s
+      AND status NOT IN ('Completed', 'Cancelled', 'System Error')
+    """
+    rows = [(row['status'],
+             row['result_info'],
+             row['error_info'],
+             row['started_at'],
+             row['completed_at'],
+             row['serv_name'],
+             row['serv_switch_info'],
+             ticket_id) for ticket_id, row in merged.items()]
+
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(update_query, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _is_transient_error(exc):
+    """连接断开、连接池耗尽等临时故障，整批留在 pending 列表中下次重试"""
+    return isinstance(exc, (mysql.connector.errors.OperationalError,
+                            mysql.connector.errors.InterfaceError,
+                            mysql.connector.errors.PoolError))
+
+
+def _ack(client, entry_ids):
+    client.xack(STATUS_STREAM_KEY, STATUS_GROUP_NAME, *entry_ids)
+    client.xdel(STATUS_STREAM_KEY, *entry_ids)
+
+
+def _dead_letter(client, entries, error):
+    """把无法写库的变更移到死信 Stream，保留原始数据以便人工处理"""
+    for entry_id, fields in entries:
+        client.xadd(STATUS_DEAD_LETTER_KEY, {
+            "data": (fields or {}).get('data', ''),
+            "entry_id": entry_id,
+            "error": error
+        })
+    _ack(client, [entry_id for entry_id, _ in entries])
+    logger.error(f"任务状态变更写库失败，已移入死信队列: count={len(entries)}, error={error}")
+
+
+def _read(client, start_id):
+    response = client.xreadgroup(STATUS_GROUP_NAME, STATUS_CONSUMER_NAME,
+                                 {STATUS_STREAM_KEY: start_id}, count=STATUS_FLUSH_BATCH_SIZE)
+    return response[0][1] if response else []
+
+
+def _drop_exhausted(client, entries):
+    """投递次数超过 STATUS_FLUSH_MAX_DELIVERIES 的 pending 变更移入死信 Stream，返回其余变更"""
+    pending = client.xpending_range(STATUS_STREAM_KEY, STATUS_GROUP_NAME,
+                                    min=entries[0][0], max=entries[-1][0], count=len(entries))
+    exhausted = {item['message_id'] for item in pending
+                 if item['times_delivered'] > STATUS_FLUSH_MAX_DELIVERIES}
+    if exhausted:
+        _dead_letter(client, [entry for entry in entries if entry[0] in exhausted],
+                     f"投递次数超过 {STATUS_FLUSH_MAX_DELIVERIES} 次")
+    return [entry for entry in entries if entry[0] not in exhausted]
+
+
+def _apply_batch(client, conn, entries):
+    """
+    写入一批变更：先整批写；整批失败时逐个任务写，永久性错误的任务移入死信 Stream
+
+    :return: 成功写库的变更条数
+    :raises: 临时故障时抛出，未确认的变更留在 pending 列表中
+    """
+    entries_by_ticket = {}
+    updates = []
+    bad_entries = []
+    for entry_id, fields in entries:
+        try:
+            update = json.loads(fields['data'])
+            entries_by_ticket.setdefault(update['ticket_id'], []).append((entry_id, fields))
+            updates.append(update)
+        except (TypeError, KeyError, ValueError):
+            bad_entries.append((entry_id, fields))
+    if bad_entries:
+        _dead_letter(client, bad_entries, "无法解析的状态变更")
+
+    merged = merge_updates(updates)
+    if not merged:
+        return 0
+    try:
+        write_updates(conn, merged)
+        _ack(client, [entry_id for ticket_entries in entries_by_ticket.values() for entry_id, _ in ticket_entries])
+        return len(updates)
+    except Exception as e:
+        if _is_transient_error(e):
+            raise
+        logger.warning(f"批量写入任务状态失败，改为逐个写入: {str(e)}")
+
+    applied = 0
+    for ticket_id, row in merged.items():
+        ticket_entries = entries_by_ticket[ticket_id]
+        try:
+            write_updates(conn, {ticket_id: row})
+        except Exception as e:
+            if _is_transient_error(e):
+                raise
+            _dead_letter(client, ticket_entries, f"ticket_id={ticket_id}: {str(e)}")
+            continue
+        _ack(client, [entry_id for entry_id, _ in ticket_entries])
+        applied += len(ticket_entries)
+    return applied
+
+
+def flush(get_db_connection):
+    """
+    把 Redis Stream 中的状态变更批量写入数据库
+
+    先处理 pending 列表中上次没有写成功的变更（只遍历一遍），再读取新的变更，直到 Stream 中没有新的变更。
+
+    :param get_db_connection: 返回数据库连接的函数
+    :return: 写入的变更条数；其他 flusher 正在运行时返回 0
+    """
+    client = _get_redis()
+    try:
+        client.xgroup_create(STATUS_STREAM_KEY, STATUS_GROUP_NAME, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+    token = str(uuid.uuid4())
+    if not client.set(STATUS_FLUSH_LOCK_KEY, token, nx=True, ex=STATUS_FLUSH_LOCK_SECONDS):
+        return 0
+
+    flushed = 0
+    try:
+        conn = get_db_connection()
+        try:
+            # pending 列表：从上次读到的位置继续往后读，每条只处理一次
+            last_id = '0'
+            while True:
+                entries = _read(client, last_id)
+                if not entries:
+                    break
+                last_id = entries[-1][0]
+                entries = _drop_exhausted(client, entries)
+                if entries:
+                    flushed += _apply_batch(client, conn, entries)
+                client.expire(STATUS_FLUSH_LOCK_KEY, STATUS_FLUSH_LOCK_SECONDS)
+
+            while True:
+                entries = _read(client, '>')
+                if not entries:
+                    break
+                flushed += _apply_batch(client, conn, entries)
+                client.expire(STATUS_FLUSH_LOCK_KEY, STATUS_FLUSH_LOCK_SECONDS)
+        finally:
+            conn.close()
+    finally:
+        if client.get(STATUS_FLUSH_LOCK_KEY) == token:
+            client.delete(STATUS_FLUSH_LOCK_KEY)
+    return flushed
+
+
+class BackgroundFlusher:
+    """
+    在后台线程中每隔 interval 秒调用一次 flush
+
+    多个进程同时运行时由 flush 的 Redis 锁保证同一时间只有一个在写库，其余直接跳过。
+
+    :param get_db_connection: 返回数据库连接的函数
+    :param interval: flush 间隔（秒）
+    """
+
+    def __init__(self, get_db_connection, interval=STATUS_FLUSH_INTERVAL):
+        self.get_db_connection = get_db_connection
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='status-flusher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止线程，并在退出前再 flush 一次"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._flush()
+
+    def _flush(self):
+        try:
+            flushed = flush(self.get_db_connection)
+            if flushed:
+                logger.info(f"已批量写入任务状态变更: {flushed}条")
+        except Exception as e:
+            # 未写入的变更仍在 pending 列表中，下次执行时重试
+            logger.error(f"批量写入任务状态变更时出错: {str(e)}")
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self._flush()
@@ -3,5 +3,15 @@
 # 停止 celery.service
 sudo systemctl stop celery.service
 
+# 停止维护 worker（-Q maintenance）和 celery beat
+sudo systemctl stop celery-maintenance.service
+sudo systemctl stop celery-beat.service
+
+# 停止 backserv.service
+sudo systemctl stop backserv.service
+
 # 检查服务状态并自动退出
 sudo systemctl status celery.service | tee /dev/null
+sudo systemctl status celery-maintenance.service | tee /dev/null
+sudo systemctl status celery-beat.service | tee /dev/null
+sudo systemctl status backserv.service | tee /dev/null
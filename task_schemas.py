@@ -0,0 +1,175 @@
+# encoding: utf-8
+"""
+task_params 参数校验
+
+每种任务类型的参数在 TASK_PARAM_SCHEMAS 中声明，模块导入时编译成校验函数。
+校验函数在提交任务时检查并规范化参数，不合法的请求在占用队列和访问数据库之前直接返回 400。
+规范化后的参数序列化为固定格式（canonical_json），可以用于缓存和去重。
+"""
+import json
+import os
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+MAX_TASK_PARAMS_BYTES = int(os.getenv('MAX_TASK_PARAMS_BYTES', 16 * 1024))
+MAX_SUBMIT_BODY_BYTES = int(os.getenv('MAX_SUBMIT_BODY_BYTES', 32 * 1024))
+MAX_USER_ID_LENGTH = int(os.getenv('MAX_USER_ID_LENGTH', 64))
+
+# 字段声明：type 为 'string' 或 'integer'；required 默认为 False
+TASK_PARAM_SCHEMAS = {
+    'Image Creation': {
+        'prompt': {'type': 'string', 'required': True, 'min_length': 1, 'max_length': 2000},
+        'negative_prompt': {'type': 'string', 'max_length': 2000},
+        'width': {'type': 'integer', 'minimum': 64, 'maximum': 2048},
+        'height': {'type': 'integer', 'minimum': 64, 'maximum': 2048},
+    },
+    'Image Upscale': {
+        'image_url': {'type': 'string', 'required': True, 'min_length': 1, 'max_length': 2048},
+        'scale_factor': {'type': 'integer', 'minimum': 1, 'maximum': 8},
+    },
+    'Face Swap': {
+        'source_image': {'type': 'string', 'required': True, 'min_length': 1, 'max_length': 2048},
+        'target_image': {'type': 'string', 'required': True, 'min_length': 1, 'max_length': 2048},
+    },
+    'Video Creation': {
+        'prompt': {'type': 'string', 'required': True, 'min_length': 1, 'max_length': 2000},
+        'duration': {'type': 'integer', 'minimum': 1, 'maximum': 60},
+        'fps': {'type': 'integer', 'minimum': 1, 'maximum': 60},
+    },
+}
+
+# API 文档中使用的 task_type 写法
+TASK_TYPE_ALIASES = {
+    'image_creation': 'Image Creation',
+    'image_upscale': 'Image Upscale',
+    'face_swap': 'Face Swap',
+    'video_creation': 'Video Creation',
+}
+
+
+class TaskParamsError(ValueError):
+    """task_type 或 task_params 不合法"""
+
+
+def _compile_string(name, spec):
+    min_length = spec.get('min_length', 0)
+    max_length = spec.get('max_length')
+
+    def check(value):
+        if not isinstance(value, str):
+            raise TaskParamsError(f"参数 {name} 必须是字符串")
+        value = value.strip()
+        if len(value) < min_length:
+            raise TaskParamsError(f"参数 {name} 不能为空")
+        if max_length is not None and len(value) > max_length:
+            raise TaskParamsError(f"参数 {name} 长度不能超过 {max_length}")
+        return value
+    return check
+
+
+def _compile_integer(name, spec):
+    minimum = spec.get('minimum')
+    maximum = spec.get('maximum')
+
+    def check(value):
+        # bool 是 int 的子类，需要单独排除；2.0 这样的整数值浮点数规范化为 int
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise TaskParamsError(f"参数 {name} 必须是整数")
+        if minimum is not None and value < minimum:
+            raise TaskParamsError(f"参数 {name} 不能小于 {minimum}")
+        if maximum is not None and value > maximum:
+            raise TaskParamsError(f"参数 {name} 不能大于 {maximum}")
+        return value
+    return check
+
+
+_FIELD_COMPILERS = {
+    'string': _compile_string,
+    'integer': _compile_integer,
+}
+
+
+def compile_schema(schema):
+    """
+    把字段声明编译成校验函数
+
+    :param schema: 字段名到字段声明的字典
+    :return: 校验函数，输入 task_params，返回规范化后的新字典，不合法时抛出 TaskParamsError
+    """
+    fields = [(name, spec.get('required', False), _FIELD_COMPILERS[spec['type']](name, spec))
+              for name, spec in sorted(schema.items())]
+    allowed = frozenset(schema)
+
+    def validate(task_params):
+        if not isinstance(task_params, dict):
+            raise TaskParamsError("task_params 必须是JSON对象")
+        unknown = task_params.keys() - allowed
+        if unknown:
+            raise TaskParamsError(f"不支持的参数: {', '.join(sorted(unknown))}")
+
+        normalized = {}
+        for name, required, check in fields:
+            value = task_params.get(name)
+            if value is None:
+                if required:
+                    raise TaskParamsError(f"缺少参数 {name}")
+                continue
+            normalized[name] = check(value)
+        return normalized
+    return validate
+
+
+# 启动时编译一次
+VALIDATORS = {task_type: compile_schema(schema) for task_type, schema in TASK_PARAM_SCHEMAS.items()}
+
+
+def canonical_json(task_params):
+    """规范化参数的固定序列化格式：键排序、无多余空白"""
+    return json.dumps(task_params, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def validate_task(task_type, task_params):
+    """
+    校验并规范化任务类型和参数
+
+    :param task_type: 任务类型，支持 'Image Creation' 或 'image_creation' 两种写法
+    :param task_params: 任务参数
+    :return: 元组 (task_type, task_params)，task_type 为 Celery 任务名，task_params 为规范化后的参数
+    :raises TaskParamsError: 任务类型未知、参数不合法或参数过大
+    """
+    if not isinstance(task_type, str):
+        raise TaskParamsError("task_type 必须是字符串")
+    task_type = TASK_TYPE_ALIASES.get(task_type, task_type)
+    validator = VALIDATORS.get(task_type)
+    if validator is None:
+        raise TaskParamsError(f"不支持的任务类型: {task_type}")
+
+    normalized = validator(task_params)
+    if len(canonical_json(normalized).encode('utf-8')) > MAX_TASK_PARAMS_BYTES:
+        raise TaskParamsError(f"task_params 不能超过 {MAX_TASK_PARAMS_BYTES} 字节")
+    return task_type, normalized
+
+
+def validate_user_id(user_id):
+    """
+    校验并规范化 user_id
+
+    :param user_id: 非空字符串（去掉首尾空白后不超过 MAX_USER_ID_LENGTH）或整数
+    :return: 规范化后的 user_id
+    :raises TaskParamsError: user_id 不合法
+    """
+    if isinstance(user_id, int) and not isinstance(user_id, bool):
+        return user_id
+    if not isinstance(user_id, str):
+        raise TaskParamsError("user_id 必须是字符串或整数")
+    user_id = user_id.strip()
+    if not user_id:
+        raise TaskParamsError("user_id 不能为空")
+    if len(user_id) > MAX_USER_ID_LENGTH:
+        raise TaskParamsError(f"user_id 长度不能超过 {MAX_USER_ID_LENGTH}")
+    return user_id
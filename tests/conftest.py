@@ -0,0 +1,129 @@
+import pytest
+import redis
+
+
+class FakePipeline:
+    """WATCH/MULTI 事务：multi() 之前的命令立即执行，之后的命令在 execute() 时执行"""
+
+    def __init__(self, client, watches):
+        self.client = client
+        self.watched = {key: client.versions.get(key, 0) for key in watches}
+        self.commands = None
+
+    def multi(self):
+        self.commands = []
+
+    def execute(self):
+        if any(self.client.versions.get(key, 0) != version for key, version in self.watched.items()):
+            raise redis.WatchError('Watched variable changed.')
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands or []]
+
+    def __getattr__(self, name):
+        if self.commands is None:
+            return getattr(self.client, name)
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+
+class FakeRedis:
+    """只实现熔断器、耗时统计和状态写入队列用到的 Redis 操作"""
+
+    def __init__(self):
+        self.data = {}
+        self.streams = {}
+        self.groups = {}
+        self.versions = {}
+        self._seq = 0
+
+    def _touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        while True:
+            pipe = FakePipeline(self, watches)
+            try:
+                value = func(pipe)
+                results = pipe.execute()
+            except redis.WatchError:
+                continue
+            return value if value_from_callable else results
+
+    def hgetall(self, key):
+        return {k: str(v) for k, v in self.data.get(key, {}).items()}
+
+    def hset(self, key, mapping):
+        self._touch(key)
+        self.data.setdefault(key, {}).update(mapping)
+
+    def hincrby(self, key, field, amount):
+        self._touch(key)
+        value = int(self.data.setdefault(key, {}).get(field, 0)) + amount
+        self.data[key][field] = value
+        return value
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self._touch(key)
+        self.data[key] = value
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, key):
+        self._touch(key)
+        self.data.pop(key, None)
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    # Stream：消费组只支持一个 consumer
+    def xadd(self, key, fields):
+        self._seq += 1
+        entry_id = f"{self._seq}-0"
+        self.streams.setdefault(key, []).append((entry_id, dict(fields)))
+        return entry_id
+
+    def xgroup_create(self, key, group, id='0', mkstream=False):
+        if (key, group) in self.groups:
+            raise redis.ResponseError('BUSYGROUP Consumer Group name already exists')
+        self.streams.setdefault(key, [])
+        self.groups[(key, group)] = {'last_id': 0, 'pending': {}}
+
+    def xreadgroup(self, group, consumer, streams, count=None):
+        (key, start_id), = streams.items()
+        state = self.groups[(key, group)]
+        entries = []
+        for entry_id, fields in self.streams.get(key, []):
+            seq = int(entry_id.split('-')[0])
+            if start_id == '>':
+                if seq <= state['last_id']:
+                    continue
+                state['last_id'] = seq
+            elif entry_id not in state['pending'] or seq <= int(start_id.split('-')[0]):
+                continue
+            state['pending'][entry_id] = state['pending'].get(entry_id, 0) + 1
+            entries.append((entry_id, fields))
+            if count and len(entries) >= count:
+                break
+        return [[key, entries]] if entries else []
+
+    def xpending_range(self, key, group, min, max, count):
+        pending = self.groups[(key, group)]['pending']
+        low, high = int(min.split('-')[0]), int(max.split('-')[0])
+        return [{'message_id': entry_id, 'times_delivered': delivered}
+                for entry_id, delivered in pending.items()
+                if low <= int(entry_id.split('-')[0]) <= high][:count]
+
+    def xack(self, key, group, *entry_ids):
+        pending = self.groups[(key, group)]['pending']
+        for entry_id in entry_ids:
+            pending.pop(entry_id, None)
+
+    def xdel(self, key, *entry_ids):
+        self.streams[key] = [entry for entry in self.streams.get(key, []) if entry[0] not in entry_ids]
+
+
+@pytest.fixture
+def redis_client():
+    return FakeRedis()
@@ -1,6 +1,15 @@
 import pytest
+import back_serv
 from back_serv import flask_app
+import io
 import json
+import os
+import profiler
+import subprocess
+import sys
+import threading
+import time
+from unittest.mock import patch, MagicMock
 
 @pytest.fixture
 def client():
@@ -79,3 +88,146 @@ def test_missing_parameters(client):
                          }),
                          content_type='application/json')
     assert response.status_code == 400
+
+def test_gateway_does_not_import_worker_modules():
+    """Test that starting the gateway does not load the Celery worker module"""
+    result = subprocess.run(
+        [sys.executable, '-c', "import sys, back_serv; sys.exit('celery_tasks' in sys.modules)"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    assert result.returncode == 0
+
+@pytest.mark.parametrize("task_params,user_id", [
+    ({'prompt': 'test', 'width': 'wide'}, 'test_user'),
+    ({'prompt': 'test'}, {'a': 1}),
+    ({'prompt': 'test'}, '  '),
+    ({'prompt': 'test'}, 'u' * 1000),
+    ({'prompt': 'test'}, True)
+])
+def test_invalid_params_rejected_before_queueing(client, task_params, user_id):
+    """Test that invalid params and user_id are rejected before any server, DB or broker work"""
+    with patch('back_serv.get_available_server') as mock_server, \
+         patch('back_serv.get_db_connection') as mock_db, \
+         patch('back_serv.get_celery_app') as mock_celery:
+        response = client.post('/submit_task',
+                             data=json.dumps({
+                                 'task_type': 'image_creation',
+                                 'task_params': task_params,
+                                 'user_id': user_id
+                             }),
+                             content_type='application/json')
+        assert response.status_code == 400
+        mock_server.assert_not_called()
+        mock_db.assert_not_called()
+        mock_celery.assert_not_called()
+
+def test_oversized_request_rejected(client):
+    """Test that oversized request bodies are rejected"""
+    response = client.post('/submit_task',
+                         data=json.dumps({
+                             'task_type': 'image_creation',
+                             'task_params': {'prompt': 'x' * 100000},
+                             'user_id': 'test_user'
+                         }),
+                         content_type='application/json')
+    assert response.status_code == 413
+
+def test_oversized_chunked_request_rejected(client):
+    """Test that the size limit also applies to bodies sent without Content-Length"""
+    body = json.dumps({
+        'task_type': 'image_creation',
+        'task_params': {'prompt': 'x' * 100000},
+        'user_id': 'test_user'
+    }).encode('utf-8')
+    with patch('back_serv.get_available_server') as mock_server:
+        response = client.post('/submit_task', input_stream=io.BytesIO(body),
+                               headers={'Content-Type': 'application/json', 'Transfer-Encoding': 'chunked'},
+                               environ_base={'wsgi.input_terminated': True})
+    assert response.status_code == 413
+    mock_server.assert_not_called()
+
+def test_werkzeug_enforces_body_limit():
+    """Test that Werkzeug caps request bodies app-wide, with room for /submit_task bodies"""
+    assert flask_app.config['MAX_CONTENT_LENGTH'] >= back_serv.task_schemas.MAX_SUBMIT_BODY_BYTES
+
+@pytest.mark.parametrize("method,path,fetched,status_code", [
+    ('get', '/query_task/unknown', None, 404),
+    ('post', '/cancel_task/unknown', None, 404),
+    ('post', '/cancel_task/running', ('In Progress',), 400)
+])
+def test_connection_returned_on_early_exit(client, method, path, fetched, status_code):
+    """Test that pooled connections are returned to the pool on every response path"""
+    with patch('back_serv.get_db_connection') as mock_db, \
+         patch('back_serv.get_celery_app'):
+        mock_db.return_value.cursor.return_value.fetchone.return_value = fetched
+        response = getattr(client, method)(path)
+        assert response.status_code == status_code
+        mock_db.return_value.close.assert_called_once()
+
+def test_connection_returned_on_error():
+    """Test that a failing query still returns its connection to the pool"""
+    with patch('back_serv.get_db_connection') as mock_db:
+        mock_db.return_value.cursor.return_value.execute.side_effect = Exception('db error')
+        with pytest.raises(Exception):
+            back_serv.get_server_load()
+        mock_db.return_value.close.assert_called_once()
+
+def test_db_pool_created_once_under_concurrency():
+    """Test that threads racing on the first request share one connection pool"""
+    created = []
+
+    def slow_pool(**kwargs):
+        created.append(kwargs)
+        time.sleep(0.05)
+        return MagicMock()
+
+    back_serv.reset_after_fork()
+    try:
+        with patch('back_serv.pooling.MySQLConnectionPool', side_effect=slow_pool), \
+             patch.dict(os.environ, {'DB_PORT': '3306'}):
+            threads = [threading.Thread(target=back_serv.get_db_connection) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+    finally:
+        back_serv.reset_after_fork()
+    assert len(created) == 1
+
+@pytest.fixture
+def profiling():
+    with patch('profiler.PROFILER_ENABLED', True), patch('profiler.PROFILER_TOKEN', 'secret'), \
+         patch('profiler.PROFILER_MAX_SECONDS', 0.05):
+        yield
+
+TOKEN = {'X-Profiler-Token': 'secret'}
+
+@pytest.mark.parametrize("seconds", ['-1', '0', 'nan', 'inf', 'abc'])
+def test_profile_rejects_invalid_seconds(client, profiling, seconds):
+    """Test that invalid sampling durations return 400 instead of crashing"""
+    response = client.get(f'/debug/profile?seconds={seconds}', headers=TOKEN)
+    assert response.status_code == 400
+
+def test_profile_clamps_seconds(client, profiling):
+    """Test that long sampling requests are capped at PROFILER_MAX_SECONDS"""
+    with patch('profiler.time.sleep') as mock_sleep:
+        response = client.get('/debug/profile?seconds=3600', headers=TOKEN)
+    assert response.status_code == 200
+    mock_sleep.assert_called_once_with(0.05)
+
+def test_profile_requires_token(client, profiling):
+    """Test that the profiler token is required, even for requests arriving from localhost"""
+    # Nginx 反向代理转发的公网请求
+    assert client.get('/debug/profile', headers={'X-Real-IP': '203.0.113.9'}).status_code == 403
+    assert client.get('/debug/profile?token=secret').status_code == 403
+    assert client.get('/debug/profile', headers={'X-Profiler-Token': 'wrong'}).status_code == 403
+    assert client.get('/debug/profile', headers=TOKEN).status_code == 200
+
+    with patch('profiler.PROFILER_TOKEN', None):
+        assert client.get('/debug/profile', headers=TOKEN).status_code == 404
+
+def test_profile_rejects_concurrent_runs(client, profiling):
+    """Test that a second profile request is rejected while one is running"""
+    with profiler._profile_lock:
+        assert client.get('/debug/profile', headers=TOKEN).status_code == 409
+    assert client.get('/debug/profile', headers=TOKEN).status_code == 200
@@ -1,5 +1,9 @@
+import json
 import pytest
-from celery_tasks import app, process_task_queue
+import requests
+from celery.exceptions import Retry, SoftTimeLimitExceeded
+import celery_tasks
+from celery_tasks import app, process_task_queue, is_retryable_error, retry_or_fail, call_ai_server, TASK_MAX_RETRIES
 from unittest.mock import patch, MagicMock
 
 @pytest.fixture
@@ -79,3 +83,153 @@ def test_server_selection():
         # Server2 should be selected as it has the lowest load
         selected_server = app.get_available_server()
         assert selected_server == 'server2'
+
+def _http_error(status_code):
+    response = MagicMock(status_code=status_code)
+    return requests.HTTPError(response=response)
+
+@pytest.mark.parametrize("exc,retryable", [
+    (requests.Timeout(), True),
+    (requests.ConnectionError(), True),
+    (SoftTimeLimitExceeded(), True),
+    (celery_tasks.NoServerAvailable(), True),
+    (_http_error(503), True),
+    (_http_error(429), True),
+    (_http_error(400), False),
+    (ValueError('bad params'), False)
+])
+def test_is_retryable_error(exc, retryable):
+    """Test classification of retryable and fatal errors"""
+    assert is_retryable_error(exc) == retryable
+
+def test_ai_timeouts_fire_before_hard_limit():
+    """Test that slow calls are flagged before the AI call times out, and timeouts fire in order"""
+    assert celery_tasks.circuit_breaker.CB_SLOW_CALL_SECONDS < celery_tasks.AI_REQUEST_TIMEOUT_SECONDS
+    assert celery_tasks.AI_REQUEST_TIMEOUT_SECONDS < celery_tasks.TASK_SOFT_TIMEOUT_SECONDS
+    assert app.conf.task_soft_time_limit < app.conf.task_time_limit
+
+def test_soft_time_limit_recorded_as_failure():
+    """Test that a call interrupted by the soft time limit counts against the server"""
+    with patch('celery_tasks.requests.post', side_effect=SoftTimeLimitExceeded()), \
+         patch('celery_tasks.circuit_breaker') as mock_breaker:
+        with pytest.raises(SoftTimeLimitExceeded):
+            call_ai_server('server1', '/image_creation', {'prompt': 'test'})
+
+    mock_breaker.record_failure.assert_called_once_with('server1', reason='SoftTimeLimitExceeded')
+    mock_breaker.record_success.assert_not_called()
+
+@pytest.mark.parametrize("exc", [requests.ConnectionError(), requests.ConnectTimeout()])
+def test_shared_endpoint_errors_not_charged_to_server(exc):
+    """Test that failing to reach the shared AI_SERVER_URL doesn't open the target server's breaker"""
+    with patch('celery_tasks.requests.post', side_effect=exc), \
+         patch('celery_tasks.circuit_breaker') as mock_breaker:
+        with pytest.raises(requests.ConnectionError):
+            call_ai_server('server1', '/image_creation', {'prompt': 'test'})
+
+    mock_breaker.record_failure.assert_not_called()
+    assert is_retryable_error(exc)
+
+def test_read_timeout_recorded_as_failure():
+    """Test that a server that accepts the request but doesn't answer counts against it"""
+    with patch('celery_tasks.requests.post', side_effect=requests.ReadTimeout()), \
+         patch('celery_tasks.circuit_breaker') as mock_breaker:
+        with pytest.raises(requests.Timeout):
+            call_ai_server('server1', '/image_creation', {'prompt': 'test'})
+
+    mock_breaker.record_failure.assert_called_once_with('server1', reason='ReadTimeout')
+
+def test_no_server_available_is_retried():
+    """Test that a transient ejection of every server backs off instead of failing the ticket"""
+    task = MagicMock()
+    task.name = 'Image Creation'
+    task.request.id = 'test_ticket'
+    task.request.retries = 0
+    task.retry.return_value = Retry()
+
+    with patch('celery_tasks.get_server_status', return_value='online'), \
+         patch('celery_tasks.circuit_breaker.allow_request', return_value=False), \
+         patch('celery_tasks.get_available_server', return_value=None), \
+         patch('celery_tasks.update_task_status') as mock_update:
+        with pytest.raises(celery_tasks.NoServerAvailable) as exc_info:
+            celery_tasks.check_and_switch_server('test_ticket', 'server1')
+        with pytest.raises(Retry):
+            retry_or_fail(task, 'server1', {'prompt': 'test'}, 'test_user', exc_info.value, str(exc_info.value))
+
+    assert [c.args[1] for c in mock_update.call_args_list] == ['Queueing']
+    assert task.retry.call_args.kwargs['args'][2] == 'server1'
+
+def test_server_status_request_has_timeout():
+    """Test that the status endpoint can't stall the retry path past the hard time limit"""
+    with patch('celery_tasks.requests.get') as mock_get:
+        mock_get.return_value.json.return_value = [{'serv_name': 'server1', 'serv_status': 'online'}]
+        assert celery_tasks.get_server_status('server1') == 'online'
+    assert mock_get.call_args.kwargs['timeout'] == celery_tasks.AI_STATUS_TIMEOUT_SECONDS
+
+def test_retry_fails_over_to_different_server():
+    """Test that a retryable failure is re-placed on another server"""
+    task = MagicMock()
+    task.name = 'Image Creation'
+    task.request.id = 'test_ticket'
+    task.request.retries = 0
+    task.retry.return_value = Retry()
+
+    with patch('celery_tasks.update_task_status') as mock_update, \
+         patch('celery_tasks.get_available_server', return_value='server2') as mock_server:
+        with pytest.raises(Retry):
+            retry_or_fail(task, 'server1', {'prompt': 'test'}, 'test_user', requests.Timeout(), 'AI服务器请求超时')
+
+    mock_server.assert_called_once_with(exclude=['server1'])
+    assert mock_update.call_args.args[1] == 'Queueing'
+    assert mock_update.call_args.kwargs['serv_name'] == 'server2'
+    _, kwargs = task.retry.call_args
+    assert kwargs['args'] == [{'prompt': 'test'}, 'test_user', 'server2']
+    assert kwargs['kwargs']['tried_servers'] == ['server1']
+    history = json.loads(mock_update.call_args.kwargs['serv_switch_info'])
+    assert kwargs['kwargs']['switch_history'] == history
+    assert [(h['from_serv'], h['to_serv'], h['error']) for h in history] == [('server1', 'server2', 'AI服务器请求超时')]
+
+def test_retry_appends_to_switch_history():
+    """Test that every attempt is kept in serv_switch_info instead of overwriting the previous one"""
+    task = MagicMock()
+    task.name = 'Image Creation'
+    task.request.id = 'test_ticket'
+    task.request.retries = 1
+    task.retry.return_value = Retry()
+    previous = [{'switch_time': '2024-12-26T12:00:00', 'from_serv': 'server1', 'to_serv': 'server2',
+                 'reason': '任务执行失败，第1次重试', 'error': 'AI服务器请求超时', 'attempt': 1}]
+
+    with patch('celery_tasks.update_task_status') as mock_update, \
+         patch('celery_tasks.get_available_server', return_value='server3'):
+        with pytest.raises(Retry):
+            retry_or_fail(task, 'server2', {'prompt': 'test'}, 'test_user', _http_error(503), 'HTTP 503',
+                          tried_servers=['server1'], switch_history=previous)
+
+    history = json.loads(mock_update.call_args.kwargs['serv_switch_info'])
+    assert history[0] == previous[0]
+    assert (history[1]['from_serv'], history[1]['to_serv'], history[1]['error'], history[1]['attempt']) == \
+        ('server2', 'server3', 'HTTP 503', 2)
+    assert len(previous) == 1
+
+def test_retry_budget_exhausted():
+    """Test that a task is marked as failed once its retry budget is used up"""
+    task = MagicMock()
+    task.name = 'Face Swap'
+    task.request.id = 'test_ticket'
+    task.request.retries = TASK_MAX_RETRIES['Face Swap']
+
+    with patch('celery_tasks.update_task_status') as mock_update:
+        result = retry_or_fail(task, 'server1', {}, 'test_user', requests.Timeout(), 'AI服务器请求超时')
+
+    assert result == {"error": "AI服务器请求超时"}
+    assert mock_update.call_args.args[1] == 'System Error'
+    task.retry.assert_not_called()
+
+@pytest.mark.parametrize("task_name,queue", [
+    ('celery_tasks.flush_task_status_updates', 'maintenance'),
+    ('celery_tasks.update_eta_statistics', 'maintenance'),
+    ('celery_tasks.process_task_queue', 'maintenance'),
+    ('Image Creation', 'celery')
+])
+def test_maintenance_tasks_routed_to_own_queue(task_name, queue):
+    """Test that beat maintenance tasks don't queue behind AI tasks"""
+    assert app.amqp.router.route({}, task_name)['queue'].name == queue
@@ -0,0 +1,122 @@
+import pytest
+import circuit_breaker
+from unittest.mock import patch
+
+
+@pytest.fixture
+def fake_redis(redis_client):
+    with patch('circuit_breaker._get_redis', return_value=redis_client):
+        yield redis_client
+
+
+@pytest.fixture
+def clock():
+    now = [1000.0]
+    with patch('circuit_breaker.time.time', side_effect=lambda: now[0]):
+        yield now
+
+
+def trip(serv_name):
+    for _ in range(circuit_breaker.CB_MIN_REQUESTS):
+        circuit_breaker.record_failure(serv_name, reason='timeout')
+
+
+def test_opens_when_failure_rate_exceeded(fake_redis, clock):
+    """Test that the breaker ejects a server after repeated failures"""
+    assert circuit_breaker.is_available('server1')
+    trip('server1')
+    assert circuit_breaker.get_state('server1') == circuit_breaker.STATE_OPEN
+    assert not circuit_breaker.is_available('server1')
+    assert not circuit_breaker.allow_request('server1')
+    assert circuit_breaker.is_available('server2')
+
+
+def test_stays_closed_below_min_requests(fake_redis, clock):
+    """Test that a few failures alone do not trip the breaker"""
+    for _ in range(circuit_breaker.CB_MIN_REQUESTS - 1):
+        circuit_breaker.record_failure('server1')
+    assert circuit_breaker.get_state('server1') == circuit_breaker.STATE_CLOSED
+
+
+def test_slow_calls_count_as_failures(fake_redis, clock):
+    """Test that calls slower than the latency threshold count as failures"""
+    for _ in range(circuit_breaker.CB_MIN_REQUESTS):
+        circuit_breaker.record_success('server1', latency=circuit_breaker.CB_SLOW_CALL_SECONDS + 1)
+    assert circuit_breaker.get_state('server1') == circuit_breaker.STATE_OPEN
+
+
+def test_half_open_trials_readmit_server(fake_redis, clock):
+    """Test half-open probing and readmission"""
+    trip('server1')
+    clock[0] += circuit_breaker.CB_OPEN_SECONDS
+    assert circuit_breaker.get_state('server1') == circuit_breaker.STATE_HALF_OPEN
+
+    for _ in range(circuit_breaker.CB_HALF_OPEN_SUCCESSES):
+        assert circuit_breaker.allow_request('server1')
+        # 试探名额用完后不再放行
+        assert not circuit_breaker.allow_request('server1')
+        circuit_breaker.record_success('server1', latency=1)
+
+    assert circuit_breaker.get_state('server1') == circuit_breaker.STATE_CLOSED
+
+
+def test_half_open_failure_reopens(fake_redis, clock):
+    """Test that a failed trial sends the server back to open"""
+    trip('server1')
+    clock[0] += circuit_breaker.CB_OPEN_SECONDS
+    assert circuit_breaker.allow_request('server1')
+    circuit_breaker.record_failure('server1', reason='HTTP 503')
+    assert circuit_breaker.get_state('server1') == circuit_breaker.STATE_OPEN
+
+
+def test_half_open_trial_not_released_while_running(fake_redis, clock):
+    """Test that a trial still inside the task time limit keeps its slot"""
+    trip('server1')
+    clock[0] += circuit_breaker.CB_OPEN_SECONDS
+    assert circuit_breaker.allow_request('server1')
+
+    # 试探任务还在执行，冷却时间再次到期也不能放行新的试探
+    for _ in range(2):
+        clock[0] += circuit_breaker.CB_OPEN_SECONDS
+        assert not circuit_breaker.allow_request('server1')
+
+    # 超过试探超时后视为丢失，释放名额
+    clock[0] += circuit_breaker.CB_TRIAL_TIMEOUT_SECONDS
+    assert circuit_breaker.allow_request('server1')
+    assert not circuit_breaker.allow_request('server1')
+
+
+def test_half_open_trials_never_negative(fake_redis, clock):
+    """Test that results arriving without a held slot don't create extra trial slots"""
+    trip('server1')
+    clock[0] += circuit_breaker.CB_OPEN_SECONDS
+    assert circuit_breaker.get_state('server1') == circuit_breaker.STATE_HALF_OPEN
+
+    # 熔断前发出的任务此时返回成功
+    circuit_breaker.record_success('server1', latency=1)
+    assert circuit_breaker._load(fake_redis, 'server1')['trials'] == 0
+    assert circuit_breaker.allow_request('server1')
+    assert not circuit_breaker.allow_request('server1')
+
+
+def test_concurrent_trial_requests_are_atomic(fake_redis, clock):
+    """Test that two processes racing for the last trial slot can't both get it"""
+    trip('server1')
+    clock[0] += circuit_breaker.CB_OPEN_SECONDS
+    circuit_breaker.get_state('server1')
+
+    results = []
+    hgetall = fake_redis.hgetall
+
+    def racing_hgetall(key):
+        # 第一次读取之后，另一个进程抢先拿到试探名额
+        data = hgetall(key)
+        if not results:
+            results.append(None)
+            results.append(circuit_breaker.allow_request('server1'))
+        return data
+
+    with patch.object(fake_redis, 'hgetall', side_effect=racing_hgetall):
+        results.append(circuit_breaker.allow_request('server1'))
+
+    assert results[1:] == [True, False]
@@ -0,0 +1,94 @@
+import pytest
+import eta_estimator
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+
+
+@pytest.fixture
+def fake_redis(redis_client):
+    with patch('eta_estimator._get_redis', return_value=redis_client):
+        yield redis_client
+
+
+def test_ewma_converges(fake_redis):
+    """Test that the EWMA tracks recent execution times"""
+    eta_estimator.record_duration('Image Creation', 'server1', 100)
+    assert eta_estimator.get_duration_stats('Image Creation', 'server1') == (100.0, 0.0)
+
+    for _ in range(50):
+        eta_estimator.record_duration('Image Creation', 'server1', 20)
+    mean, std = eta_estimator.get_duration_stats('Image Creation', 'server1')
+    assert mean == pytest.approx(20, abs=0.1)
+    assert std < 1
+
+
+def test_default_duration_without_history(fake_redis):
+    """Test the fallback when no task has completed yet"""
+    assert eta_estimator.get_duration_stats('Face Swap', 'server1') == (eta_estimator.ETA_DEFAULT_SECONDS, 0.0)
+
+
+def _completed_row(ticket_id, completed_at, seconds=30):
+    return {
+        'ticket_id': ticket_id,
+        'task_type': 'Image Creation',
+        'serv_name': 'server1',
+        'started_at': completed_at - timedelta(seconds=seconds),
+        'completed_at': completed_at
+    }
+
+
+def test_refresh_stats_is_incremental(fake_redis):
+    """Test that refresh only reads rows after the stored watermark"""
+    completed_at = datetime(2024, 12, 26, 12, 0, 0)
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [_completed_row('ticket1', completed_at)]
+
+    assert eta_estimator.refresh_stats(conn, now=completed_at) == 1
+    assert cursor.execute.call_args.args[1][:2] == ('1970-01-01 00:00:00', '')
+    assert eta_estimator.get_duration_stats('Image Creation', 'server1')[0] == 30.0
+
+    cursor.fetchall.return_value = []
+    assert eta_estimator.refresh_stats(conn, now=completed_at + timedelta(hours=1)) == 0
+    assert cursor.execute.call_args.args[1][:2] == ('2024-12-26 12:00:00', '')
+
+
+def test_refresh_stats_picks_up_late_rows(fake_redis):
+    """Test that rows written after the watermark moved past them are still counted, once"""
+    now = datetime(2024, 12, 26, 12, 0, 0)
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [_completed_row('ticket1', now)]
+    assert eta_estimator.refresh_stats(conn, now=now) == 1
+
+    # ticket0 比 ticket1 更早完成，但状态晚写入数据库
+    cursor.fetchall.return_value = [_completed_row('ticket0', now - timedelta(seconds=5), seconds=130),
+                                    _completed_row('ticket1', now)]
+    assert eta_estimator.refresh_stats(conn, now=now + timedelta(minutes=1)) == 1
+    lag_start = now + timedelta(minutes=1) - timedelta(seconds=eta_estimator.ETA_REFRESH_LAG_SECONDS)
+    assert cursor.execute.call_args.args[1][:2] == (lag_start.strftime('%Y-%m-%d %H:%M:%S'), '')
+    assert eta_estimator.get_duration_stats('Image Creation', 'server1')[0] == pytest.approx(50.0)
+
+
+def test_estimate_queued_task(fake_redis):
+    """Test ETA for a queued task behind the server backlog"""
+    now = datetime(2024, 12, 26, 12, 0, 0)
+    eta_estimator.record_duration('Image Creation', 'server1', 40)
+    cursor = MagicMock()
+    cursor.fetchall.return_value = [
+        {'task_type': 'Image Creation', 'status': 'In Progress', 'started_at': now - timedelta(seconds=10)},
+        {'task_type': 'Image Creation', 'status': 'Queueing', 'started_at': None}
+    ]
+    task_info = {
+        'ticket_id': 'ticket1',
+        'task_type': 'Image Creation',
+        'serv_name': 'server1',
+        'status': 'Queueing',
+        'created_at': now,
+        'started_at': None
+    }
+
+    result = eta_estimator.estimate(cursor, task_info, now=now)
+    assert result['estimated_start'] == (now + timedelta(seconds=70)).isoformat()
+    assert result['estimated_completion'] == (now + timedelta(seconds=110)).isoformat()
+    assert result['poll_interval'] == 27
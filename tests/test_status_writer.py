@@ -0,0 +1,179 @@
+import json
+import mysql.connector
+import pytest
+import status_writer
+import time
+from unittest.mock import patch, MagicMock
+
+
+def _update(ticket_id, status, event_time, **kwargs):
+    update = {
+        'ticket_id': ticket_id,
+        'status': status,
+        'result_info': None,
+        'error_info': None,
+        'serv_name': None,
+        'serv_switch_info': None,
+        'event_time': event_time
+    }
+    update.update(kwargs)
+    return update
+
+
+def test_merge_keeps_order_per_ticket():
+    """Test that updates for one ticket collapse into a single row in order"""
+    merged = status_writer.merge_updates([
+        _update('ticket1', 'In Progress', '2024-12-26 12:00:00', serv_name='server1'),
+        _update('ticket2', 'In Progress', '2024-12-26 12:00:01'),
+        _update('ticket1', 'Completed', '2024-12-26 12:00:30', result_info='{"image_urls": []}')
+    ])
+
+    assert list(merged) == ['ticket1', 'ticket2']
+    assert merged['ticket1']['status'] == 'Completed'
+    assert merged['ticket1']['started_at'] == '2024-12-26 12:00:00'
+    assert merged['ticket1']['completed_at'] == '2024-12-26 12:00:30'
+    assert merged['ticket1']['serv_name'] == 'server1'
+    assert merged['ticket1']['result_info'] == '{"image_urls": []}'
+    assert merged['ticket2']['completed_at'] is None
+
+
+def test_merge_is_monotonic():
+    """Test that a late In Progress can't overwrite Completed"""
+    merged = status_writer.merge_updates([
+        _update('ticket1', 'Completed', '2024-12-26 12:00:30', result_info='{}'),
+        _update('ticket1', 'In Progress', '2024-12-26 12:00:31')
+    ])
+
+    assert merged['ticket1']['status'] == 'Completed'
+    assert merged['ticket1']['result_info'] == '{}'
+    assert merged['ticket1']['started_at'] is None
+
+
+def test_write_updates_single_transaction():
+    """Test that merged updates are written with one executemany and one commit"""
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    merged = status_writer.merge_updates([
+        _update('ticket1', 'In Progress', '2024-12-26 12:00:00'),
+        _update('ticket2', 'System Error', '2024-12-26 12:00:01', error_info='AI服务器请求超时')
+    ])
+
+    status_writer.write_updates(conn, merged)
+
+    query, rows = cursor.executemany.call_args.args
+    assert "status NOT IN ('Completed', 'Cancelled', 'System Error')" in query
+    assert [row[-1] for row in rows] == ['ticket1', 'ticket2']
+    conn.commit.assert_called_once()
+
+
+@pytest.fixture
+def fake_redis(redis_client):
+    with patch('status_writer._get_redis', return_value=redis_client):
+        yield redis_client
+
+
+def _enqueue(ticket_id, status, **kwargs):
+    status_writer.enqueue_status(ticket_id, status, **kwargs)
+
+
+def _pending(client):
+    return client.groups[(status_writer.STATUS_STREAM_KEY, status_writer.STATUS_GROUP_NAME)]['pending']
+
+
+def test_flush_acks_only_after_commit(fake_redis):
+    """Test that entries stay pending when the commit fails, and are retried on the next flush"""
+    _enqueue('ticket1', 'In Progress')
+    _enqueue('ticket1', 'Completed', result_info='{}')
+    conn = MagicMock()
+    conn.commit.side_effect = mysql.connector.errors.OperationalError('MySQL server has gone away')
+
+    with pytest.raises(mysql.connector.errors.OperationalError):
+        status_writer.flush(lambda: conn)
+    assert len(_pending(fake_redis)) == 2
+    assert len(fake_redis.streams[status_writer.STATUS_STREAM_KEY]) == 2
+    assert fake_redis.get(status_writer.STATUS_FLUSH_LOCK_KEY) is None
+    conn.close.assert_called_once()
+
+    conn.commit.side_effect = None
+    assert status_writer.flush(lambda: conn) == 2
+    assert not _pending(fake_redis)
+    assert fake_redis.streams[status_writer.STATUS_STREAM_KEY] == []
+    _, rows = conn.cursor.return_value.executemany.call_args.args
+    assert rows[0][0] == 'Completed'
+
+
+def test_flush_skips_when_locked(fake_redis):
+    """Test that only one flusher runs at a time"""
+    _enqueue('ticket1', 'In Progress')
+    fake_redis.set(status_writer.STATUS_FLUSH_LOCK_KEY, 'other')
+    get_conn = MagicMock()
+
+    assert status_writer.flush(get_conn) == 0
+    get_conn.assert_not_called()
+    assert fake_redis.get(status_writer.STATUS_FLUSH_LOCK_KEY) == 'other'
+    assert len(fake_redis.streams[status_writer.STATUS_STREAM_KEY]) == 1
+
+
+def test_flush_isolates_poison_rows(fake_redis):
+    """Test that a row the DB rejects is dead-lettered without blocking other updates"""
+    _enqueue('bad', 'System Error', error_info='x' * 100000)
+    _enqueue('good', 'Completed', result_info='{}')
+
+    def executemany(query, rows):
+        if any(row[-1] == 'bad' for row in rows):
+            raise mysql.connector.errors.DataError("Data too long for column 'error_info'")
+    conn = MagicMock()
+    conn.cursor.return_value.executemany.side_effect = executemany
+
+    assert status_writer.flush(lambda: conn) == 1
+    assert not _pending(fake_redis)
+    dead = fake_redis.streams[status_writer.STATUS_DEAD_LETTER_KEY]
+    assert len(dead) == 1
+    assert json.loads(dead[0][1]['data'])['ticket_id'] == 'bad'
+
+    # 之后的新变更照常写入
+    _enqueue('next', 'In Progress')
+    assert status_writer.flush(lambda: conn) == 1
+
+
+def test_flush_dead_letters_after_max_deliveries(fake_redis):
+    """Test that an entry retried too many times is moved to the dead-letter stream"""
+    _enqueue('ticket1', 'In Progress')
+    conn = MagicMock()
+    conn.commit.side_effect = mysql.connector.errors.OperationalError('Lost connection')
+
+    with patch('status_writer.STATUS_FLUSH_MAX_DELIVERIES', 2):
+        for _ in range(2):
+            with pytest.raises(mysql.connector.errors.OperationalError):
+                status_writer.flush(lambda: conn)
+        assert status_writer.flush(lambda: conn) == 0
+
+    assert not _pending(fake_redis)
+    assert len(fake_redis.streams[status_writer.STATUS_DEAD_LETTER_KEY]) == 1
+
+
+def test_background_flusher_drains_stream(fake_redis):
+    """Test that the worker-side flusher thread writes changes without beat"""
+    conn = MagicMock()
+    flusher = status_writer.BackgroundFlusher(lambda: conn, interval=0.01)
+    flusher.start()
+    _enqueue('ticket1', 'Completed', result_info='{}')
+    for _ in range(200):
+        if not fake_redis.streams[status_writer.STATUS_STREAM_KEY]:
+            break
+        time.sleep(0.01)
+    flusher.stop()
+
+    assert fake_redis.streams[status_writer.STATUS_STREAM_KEY] == []
+    conn.commit.assert_called()
+
+
+def test_background_flusher_flushes_on_stop(fake_redis):
+    """Test that pending changes are written when the worker process shuts down"""
+    conn = MagicMock()
+    flusher = status_writer.BackgroundFlusher(lambda: conn, interval=3600)
+    flusher.start()
+    _enqueue('ticket1', 'In Progress')
+    flusher.stop()
+
+    assert fake_redis.streams[status_writer.STATUS_STREAM_KEY] == []
@@ -0,0 +1,46 @@
+import pytest
+import task_schemas
+from task_schemas import TaskParamsError, validate_task, canonical_json
+
+
+def test_validate_normalizes_params():
+    """Test that valid params are normalized into a canonical form"""
+    task_type, params = validate_task('image_creation', {'width': 512.0, 'prompt': '  a beautiful sunset '})
+    assert task_type == 'Image Creation'
+    assert params == {'prompt': 'a beautiful sunset', 'width': 512}
+    assert canonical_json(params) == '{"prompt":"a beautiful sunset","width":512}'
+
+
+def test_equivalent_params_share_canonical_form():
+    """Test that differently ordered/formatted params produce the same canonical JSON"""
+    _, a = validate_task('Image Upscale', {'scale_factor': 2, 'image_url': 'test.jpg'})
+    _, b = validate_task('image_upscale', {'image_url': ' test.jpg', 'scale_factor': 2.0})
+    assert canonical_json(a) == canonical_json(b)
+
+
+@pytest.mark.parametrize("task_type,task_params", [
+    ('invalid_type', {}),
+    (['image_creation'], {}),
+    ('image_creation', 'prompt'),
+    ('image_creation', {}),
+    ('image_creation', {'prompt': ''}),
+    ('image_creation', {'prompt': 'test', 'width': 'wide'}),
+    ('image_creation', {'prompt': 'test', 'width': True}),
+    ('image_creation', {'prompt': 'test', 'width': 10000}),
+    ('image_creation', {'prompt': 'test', 'serv_name': 'server1'}),
+    ('image_creation', {'prompt': 'x' * 5000}),
+    ('face_swap', {'source_image': 'source.jpg'})
+])
+def test_invalid_params_rejected(task_type, task_params):
+    """Test that invalid task types and params raise TaskParamsError"""
+    with pytest.raises(TaskParamsError):
+        validate_task(task_type, task_params)
+
+
+def test_params_size_cap():
+    """Test that oversized params are rejected"""
+    params = {'prompt': 'x' * 2000, 'negative_prompt': 'y' * 2000}
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(task_schemas, 'MAX_TASK_PARAMS_BYTES', 1024)
+        with pytest.raises(TaskParamsError):
+            validate_task('image_creation', params)
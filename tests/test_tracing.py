@@ -0,0 +1,76 @@
+import pytest
+import threading
+import profiler
+import tracing
+from types import SimpleNamespace
+from unittest.mock import patch
+
+
+@pytest.fixture
+def span_exporter():
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    with patch('tracing._tracer', provider.get_tracer('test')):
+        yield exporter
+
+
+def test_tracing_disabled_is_noop():
+    """Test that spans are no-ops when tracing is not enabled"""
+    with patch('tracing._tracer', None):
+        with tracing.span('submit_task') as current_span:
+            assert current_span is None
+        assert tracing.inject_headers('test_ticket') == {'ticket_id': 'test_ticket'}
+        assert tracing.start_task_span(SimpleNamespace()) is None
+
+
+def test_trace_context_propagates_to_task(span_exporter):
+    """Test that the ticket's trace context is carried through Celery headers"""
+    with tracing.span('submit_task', ticket_id='test_ticket'):
+        headers = tracing.inject_headers('test_ticket')
+    assert 'traceparent' in headers
+
+    # 自定义消息头在 worker 中会成为 task.request 的属性
+    request = SimpleNamespace(id='test_ticket', retries=0, **headers)
+    task = SimpleNamespace(name='Image Creation', request=request)
+    handle = tracing.start_task_span(task)
+    with tracing.span('call_ai_server'):
+        pass
+    tracing.end_task_span(handle, 'SUCCESS')
+
+    spans = {s.name: s for s in span_exporter.get_finished_spans()}
+    trace_id = spans['submit_task'].context.trace_id
+    assert spans['Image Creation'].context.trace_id == trace_id
+    assert spans['Image Creation'].parent.span_id == spans['submit_task'].context.span_id
+    assert spans['call_ai_server'].parent.span_id == spans['Image Creation'].context.span_id
+    assert spans['Image Creation'].attributes['ticket_id'] == 'test_ticket'
+
+
+def test_stack_sampler_collapsed_output():
+    """Test that the sampler produces collapsed stacks for other threads"""
+    ready = threading.Event()
+    done = threading.Event()
+
+    def busy_function():
+        ready.set()
+        done.wait()
+
+    thread = threading.Thread(target=busy_function)
+    thread.start()
+    ready.wait()
+    sampler = profiler.StackSampler()
+    sampler.sample()
+    sampler.sample()
+    done.set()
+    thread.join()
+
+    lines = sampler.collapsed().splitlines()
+    busy = [line for line in lines if 'busy_function' in line]
+    assert busy
+    stack, count = busy[0].rsplit(' ', 1)
+    assert count == '2'
+    assert stack.index('_bootstrap') < stack.index('busy_function')
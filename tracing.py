@@ -0,0 +1,150 @@
+# encoding: utf-8
+"""
+请求链路追踪
+
+基于 OpenTelemetry，默认关闭（TRACING_ENABLED=1 开启）。span 以 JSON 行的形式写入本地文件，
+配置了 OTEL_EXPORTER_OTLP_ENDPOINT 时同时发送到 OTLP collector。
+网关提交任务时把 trace context（W3C traceparent）和 ticket_id 放进 Celery 消息头，
+worker 执行任务时从消息头恢复，使一次请求在网关和 worker 中的 span 属于同一条 trace。
+未开启时所有函数都是空操作，不会导入 opentelemetry。
+"""
+import logging
+import os
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', '0') == '1'
+TRACING_SAMPLE_RATIO = float(os.getenv('TRACING_SAMPLE_RATIO', 1.0))
+TRACING_EXPORT_FILE = os.getenv('TRACING_EXPORT_FILE', 'traces.jsonl')
+
+_tracer = None
+
+
+def init_tracing(service_name):
+    """
+    初始化 tracer，需要在每个进程中调用一次（worker 在子进程 fork 之后调用）
+
+    :param service_name: 写入 span resource 的服务名，例如 'back_serv' 或 'celery_worker'
+    """
+    global _tracer
+    if not TRACING_ENABLED or _tracer is not None:
+        return
+
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': service_name, 'process.pid': os.getpid()}),
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO))
+    )
+    export_file = open(TRACING_EXPORT_FILE, 'a', encoding='utf-8')
+    provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter(
+        out=export_file,
+        formatter=lambda span: span.to_json(indent=None) + os.linesep
+    )))
+
+    if os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT'):
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer(service_name)
+    logger.info(f"已开启链路追踪: service_name={service_name}, export_file={TRACING_EXPORT_FILE}")
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    在当前 trace 下创建一个子 span，未开启追踪时返回 None
+
+    用法::
+
+        with tracing.span('get_server_load'):
+            server_loads = get_server_load()
+    """
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes) as current_span:
+        yield current_span
+
+
+def set_attribute(key, value):
+    """给当前 span 添加属性"""
+    if _tracer is None:
+        return
+    from opentelemetry import trace
+    trace.get_current_span().set_attribute(key, value)
+
+
+def inject_headers(ticket_id):
+    """
+    生成 Celery 消息头，包含当前 trace context 和 ticket_id
+
+    :param ticket_id: 任务的ticket_id
+    :return: 传给 send_task(headers=...) 的字典
+    """
+    headers = {'ticket_id': ticket_id}
+    if _tracer is not None:
+        from opentelemetry.propagate import inject
+        inject(headers)
+    return headers
+
+
+class _TaskRequestGetter:
+    """从 Celery task.request 中读取消息头，自定义消息头会成为 request 的属性"""
+
+    def get(self, carrier, key):
+        value = getattr(carrier, key, None)
+        return [value] if value is not None else None
+
+    def keys(self, carrier):
+        return []
+
+
+def start_task_span(task):
+    """
+    在 task_prerun 中调用，从消息头恢复 trace context 并开始任务的 span
+
+    :param task: Celery 任务
+    :return: 传给 end_task_span 的句柄，未开启追踪时返回 None
+    """
+    if _tracer is None:
+        return None
+    from opentelemetry import context, trace
+    from opentelemetry.propagate import extract
+
+    parent = extract(task.request, getter=_TaskRequestGetter())
+    task_span = _tracer.start_span(
+        task.name,
+        context=parent,
+        kind=trace.SpanKind.CONSUMER,
+        attributes={
+            'ticket_id': getattr(task.request, 'ticket_id', None) or task.request.id,
+            'celery.task_name': task.name,
+            'celery.retries': task.request.retries or 0
+        }
+    )
+    token = context.attach(trace.set_span_in_context(task_span, parent))
+    return task_span, token
+
+
+def end_task_span(handle, state=None):
+    """在 task_postrun 中调用，结束任务的 span"""
+    if handle is None:
+        return
+    from opentelemetry import context
+    task_span, token = handle
+    if state:
+        task_span.set_attribute('celery.state', state)
+    task_span.end()
+    context.detach(token)